@@ -0,0 +1,103 @@
+#!/usr/local/sbin/charm-env python3
+# Copyright 2025 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""SMTP DKIM signing charm actions."""
+
+import os
+import sys
+import traceback
+
+sys.path.append("lib")
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from charmhelpers.core import hookenv, unitdata  # NOQA: E402
+
+from reactive import smtp_dkim_signing  # NOQA: E402
+
+
+def audit_keys() -> None:
+    """Report the algorithm, size and signing cost of each configured key."""
+    params = hookenv.action_get()
+    keys = smtp_dkim_signing.audit_signing_keys(seconds=float(params.get("seconds", 1)))
+    lines = []
+    for key in keys:
+        if "error" in key:
+            lines.append(f"{key['path']}: {key['error']}")
+            continue
+        lines.append(
+            f"{key['path']}: {key['algorithm']} {key['bits']} bits"
+            f", {key['signs_per_sec']:.0f} signatures/sec, {key['fingerprint']}"
+            f", tenants: {', '.join(key['tenants'])}"
+        )
+    # Keys come slowest first, so are their tenants.
+    tenants = [
+        f"{tenant}: {1000 / key['signs_per_sec']:.3f} ms/signature ({key['path']})"
+        for key in keys
+        if key.get("signs_per_sec")
+        for tenant in key["tenants"]
+    ]
+    hookenv.action_set(
+        {
+            "keys": "\n".join(lines),
+            "most-expensive": "\n".join(tenants[: int(params.get("top", 10))]),
+        }
+    )
+
+
+def get_dns_records() -> None:
+    """Show the DNS TXT records to publish for the signing keys."""
+    records = smtp_dkim_signing.dkim_dns_records()
+    hookenv.action_set({state: "\n".join(lines) for state, lines in records.items()})
+
+
+def milter_proxy_stats() -> None:
+    """Show the sessions outstanding on each worker behind the milter proxy."""
+    stats = smtp_dkim_signing.milter_proxy_stats()
+    if not stats:
+        hookenv.action_fail("No milter proxy statistics, is milter_proxy_workers set?")
+        return
+    hookenv.action_set(
+        {
+            "workers": "\n".join(
+                f"{name}: {worker['outstanding']} outstanding, {worker['sessions']} sessions"
+                f", {worker['errors']} errors{', draining' if worker['draining'] else ''}"
+                for name, worker in sorted(stats["workers"].items())
+            )
+        }
+    )
+
+
+def rotate_key() -> None:
+    """Switch signing over to the staged signing key."""
+    try:
+        selectors = smtp_dkim_signing.rotate_signing_key()
+    except ValueError as e:
+        hookenv.action_fail(str(e))
+        return
+    # Only the selector and key file change, so opendkim picks the new key
+    # up on reload without dropping in-flight milter connections.
+    smtp_dkim_signing.configure_smtp_dkim_signing()
+    hookenv.action_set(selectors)
+
+
+ACTIONS = {
+    "audit-keys": audit_keys,
+    "get-dns-records": get_dns_records,
+    "milter-proxy-stats": milter_proxy_stats,
+    "rotate-key": rotate_key,
+}
+
+
+def main(argv: list) -> None:
+    action = os.path.basename(argv[0])
+    try:
+        ACTIONS[action]()
+    except Exception:  # pylint: disable=broad-except
+        hookenv.action_fail(traceback.format_exc())
+    finally:
+        unitdata.kv().flush()
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+# Copyright 2025 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Milter front proxy spreading milter sessions over local opendkim workers.
+
+The proxy holds the milter port relays connect to, so the opendkim workers
+behind it can be restarted without relays seeing refused connections. Each
+milter session (connection) is passed to the worker with the fewest sessions
+outstanding, skipping workers being drained and ones that refuse it.
+
+The config, a JSON file written by the charm, is re-read on SIGHUP without
+dropping sessions or the listening socket:
+
+    {"port": 8892, "stats": "/run/opendkim-milter-proxy/stats.json",
+     "workers": [{"name": "worker-1", "port": 8901}, ...],
+     "draining": ["worker-1"]}
+
+Workers left out of a reloaded config are tracked, as draining, until their
+sessions end. The number of sessions outstanding on each worker is written
+to the stats file every second.
+"""
+
+import argparse
+import asyncio
+import dataclasses
+import json
+import os
+import signal
+import sys
+import time
+import typing
+
+BUFFER_SIZE = 65536
+# Seconds to wait for a worker to accept a session before trying the next.
+CONNECT_TIMEOUT = 5
+STATS_INTERVAL = 1
+
+
+@dataclasses.dataclass
+class Worker:
+    """A local opendkim worker and the sessions passed to it.
+
+    Attributes:
+        name: Name of the worker.
+        port: Local port the worker listens on.
+        draining: Whether the worker gets no new sessions.
+        outstanding: Number of sessions currently passed to the worker.
+        sessions: Number of sessions passed to the worker so far.
+        errors: Number of times the worker failed to accept a session.
+    """
+
+    name: str
+    port: int
+    draining: bool = False
+    outstanding: int = 0
+    sessions: int = 0
+    errors: int = 0
+
+    def stats(self) -> typing.Dict[str, typing.Any]:
+        """Get the worker's statistics.
+
+        Returns:
+            The worker's attributes other than its name.
+        """
+        stats = dataclasses.asdict(self)
+        del stats["name"]
+        return stats
+
+
+async def _pipe(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    """Copy data from one side of a session to the other until either closes."""
+    try:
+        while True:
+            data = await reader.read(BUFFER_SIZE)
+            if not data:
+                break
+            writer.write(data)
+            await writer.drain()
+    except (ConnectionError, OSError):
+        pass
+    finally:
+        # Closing one side also ends the copy in the other direction.
+        writer.close()
+
+
+class MilterProxy:
+    """Spreads milter sessions over the workers of a config file."""
+
+    def __init__(self, config_path: str) -> None:
+        """Load the config.
+
+        Args:
+            config_path: Path to the JSON config file.
+        """
+        self.config_path = config_path
+        self.config: typing.Dict[str, typing.Any] = {}
+        self.workers: typing.Dict[str, Worker] = {}
+        # Workers no longer in the config, with sessions still outstanding.
+        self.removed: typing.Dict[str, Worker] = {}
+        self.reloaded = 0.0
+        self.reload()
+
+    def reload(self) -> None:
+        """Re-read the config, keeping the sessions of workers still in it going.
+
+        Sessions on workers no longer in the config carry on until they end,
+        with the workers tracked as draining until then.
+        """
+        with open(self.config_path, "r", encoding="utf-8") as f:
+            config = json.load(f)
+        known = {**self.removed, **self.workers}
+        workers = {}
+        for entry in config["workers"]:
+            worker = known.pop(entry["name"], None) or Worker(entry["name"], entry["port"])
+            worker.port = entry["port"]
+            worker.draining = entry["name"] in config.get("draining", [])
+            workers[worker.name] = worker
+        for worker in known.values():
+            worker.draining = True
+        self.config = config
+        self.workers = workers
+        self.removed = {name: worker for name, worker in known.items() if worker.outstanding}
+        self.reloaded = time.time()
+        self.write_stats()
+
+    def pick(self, exclude: typing.Container[str] = ()) -> typing.Optional[Worker]:
+        """Find the worker with the fewest sessions outstanding that is not draining.
+
+        Args:
+            exclude: Names of the workers not to pick.
+
+        Returns:
+            The worker, or None if there is none to pick.
+        """
+        candidates = [w for w in self.workers.values() if not w.draining and w.name not in exclude]
+        return min(candidates, key=lambda w: (w.outstanding, w.name), default=None)
+
+    async def _connect(
+        self,
+    ) -> typing.Tuple[Worker, asyncio.StreamReader, asyncio.StreamWriter]:
+        """Connect to the least busy worker that accepts the session and reserve it."""
+        tried: typing.Set[str] = set()
+        while True:
+            worker = self.pick(tried)
+            if worker is None:
+                raise ConnectionRefusedError("No worker accepted the session")
+            # Count the session as soon as the worker is picked, so sessions
+            # arriving while connecting are spread over the other workers.
+            worker.outstanding += 1
+            try:
+                reader, writer = await asyncio.wait_for(
+                    asyncio.open_connection("127.0.0.1", worker.port), CONNECT_TIMEOUT
+                )
+                return worker, reader, writer
+            except (OSError, asyncio.TimeoutError):
+                self._release(worker)
+                worker.errors += 1
+                tried.add(worker.name)
+
+    def _release(self, worker: Worker) -> None:
+        """Count a session of a worker as ended, forgetting removed workers left idle."""
+        worker.outstanding -= 1
+        if not worker.outstanding and self.removed.get(worker.name) is worker:
+            del self.removed[worker.name]
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Pass a milter session on to a worker.
+
+        Args:
+            reader: Reader of the session from the relay.
+            writer: Writer of the session to the relay.
+        """
+        try:
+            worker, upstream_reader, upstream_writer = await self._connect()
+        except OSError as e:
+            print(e, file=sys.stderr)
+            writer.close()
+            return
+        worker.sessions += 1
+        try:
+            await asyncio.gather(_pipe(reader, upstream_writer), _pipe(upstream_reader, writer))
+        finally:
+            self._release(worker)
+
+    def write_stats(self) -> None:
+        """Write the statistics of each worker to the stats file, if any."""
+        path = self.config.get("stats")
+        if not path:
+            return
+        workers = {**self.removed, **self.workers}
+        stats = {
+            "reloaded": self.reloaded,
+            "updated": time.time(),
+            "workers": {name: worker.stats() for name, worker in workers.items()},
+        }
+        with open(path + ".new", "w", encoding="utf-8") as f:
+            json.dump(stats, f, indent=2, sort_keys=True)
+        os.replace(path + ".new", path)
+
+    async def serve(self) -> None:
+        """Listen on the milter port and pass sessions on until stopped."""
+        loop = asyncio.get_running_loop()
+        stopped = loop.create_future()
+        loop.add_signal_handler(signal.SIGHUP, self._reload_or_keep)
+        loop.add_signal_handler(signal.SIGTERM, stopped.set_result, None)
+        server = await asyncio.start_server(
+            self.handle, host=self.config.get("address") or None, port=self.config["port"]
+        )
+        async with server:
+            while not stopped.done():
+                await asyncio.wait([stopped], timeout=STATS_INTERVAL)
+                self.write_stats()
+
+    def _reload_or_keep(self) -> None:
+        """Reload the config, or keep the current one if the new one is broken."""
+        try:
+            self.reload()
+        except (OSError, ValueError, KeyError) as e:
+            print(
+                f"Keeping current config, unable to load {self.config_path}: {e}", file=sys.stderr
+            )
+
+
+def main(argv: typing.Optional[typing.Sequence[str]] = None) -> int:
+    """Run the proxy until it is stopped.
+
+    Args:
+        argv: Command line arguments, those of the process if None.
+
+    Returns:
+        The exit status.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--config", required=True, help="path to the JSON config file")
+    args = parser.parse_args(argv)
+    asyncio.run(MilterProxy(args.config).serve())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
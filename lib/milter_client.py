@@ -0,0 +1,277 @@
+# Copyright 2025 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Minimal milter protocol client, playing the MTA side of a milter session.
+
+Just enough of the protocol (version 6, as spoken by libmilter) to pass a
+message through a milter such as opendkim and collect what it asks the MTA to
+do with it, e.g. to check a new opendkim config signs messages before rolling
+it out.
+"""
+
+import ipaddress
+import socket
+import struct
+import time
+import typing
+
+SMFI_VERSION = 6
+# Actions we can carry out, and protocol steps we can send or skip.
+SMFI_ACTIONS = 0x1FF
+SMFI_PROTOCOL = 0xFFFFF
+
+# Protocol flags the milter can set to skip a step, or to not reply to it.
+SMFIP_NO = {"C": 0x1, "H": 0x2, "M": 0x4, "R": 0x8, "B": 0x10, "L": 0x20, "N": 0x40, "T": 0x200}
+SMFIP_NR = {
+    "C": 0x1000,
+    "H": 0x2000,
+    "M": 0x4000,
+    "R": 0x8000,
+    "T": 0x10000,
+    "N": 0x40000,
+    "B": 0x80000,
+    "L": 0x80,
+}
+
+# Replies ending a step, and what they mean.
+REPLIES = {
+    b"a": "accept",
+    b"c": "continue",
+    b"d": "discard",
+    b"r": "reject",
+    b"s": "skip",
+    b"t": "tempfail",
+    b"y": "replycode",
+}
+
+BODY_CHUNK_SIZE = 65535
+
+
+class MilterError(Exception):
+    """The milter broke the protocol or went away."""
+
+
+class MilterResult(typing.NamedTuple):
+    """Outcome of passing a message through a milter.
+
+    Attributes:
+        action: Final action the milter asked for, such as "accept" or "reject".
+        headers: Headers the milter asked to add, as name and value.
+        elapsed: Seconds the milter took to handle the message.
+    """
+
+    action: str
+    headers: typing.List[typing.Tuple[str, str]]
+    elapsed: float
+
+
+def split_message(message: bytes) -> typing.Tuple[typing.List[typing.Tuple[str, str]], bytes]:
+    """Split a message into its (unfolded) headers and its body, with CRLF line endings.
+
+    Args:
+        message: The message.
+
+    Returns:
+        The headers, as name and value, and the body.
+    """
+    message = message.replace(b"\r\n", b"\n")
+    head, _, body = message.partition(b"\n\n")
+    headers: typing.List[typing.Tuple[str, str]] = []
+    for line in head.decode("utf-8", "surrogateescape").split("\n"):
+        if line[:1] in (" ", "\t") and headers:
+            headers[-1] = (headers[-1][0], headers[-1][1] + "\r\n" + line)
+        elif ":" in line:
+            name, _, value = line.partition(":")
+            headers.append((name, value.lstrip(" ")))
+    return headers, body.replace(b"\n", b"\r\n")
+
+
+class MilterClient:
+    """A milter session with a single milter."""
+
+    def __init__(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self,
+        address: str,
+        port: int,
+        timeout: float = 10,
+        client_address: str = "127.0.0.1",
+        client_hostname: str = "localhost",
+    ) -> None:
+        """Connect to the milter and negotiate the protocol.
+
+        Args:
+            address: Address the milter listens on.
+            port: Port the milter listens on.
+            timeout: Seconds to wait for the milter to reply to each step.
+            client_address: IPv4 or IPv6 address the messages are passed on as received from.
+            client_hostname: Host name the messages are passed on as received from.
+        """
+        self.sock = socket.create_connection((address, port), timeout=timeout)
+        # Each step is a small request waiting on a small reply.
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.client_address = client_address
+        self.client_hostname = client_hostname
+        self.protocol = 0
+        self.connected = False
+        self._negotiate()
+
+    def close(self) -> None:
+        """Quit the session and close the connection."""
+        try:
+            self._send(b"Q")
+        except OSError:
+            pass
+        self.sock.close()
+
+    def __enter__(self) -> "MilterClient":
+        """Enter the session, which is closed on exit.
+
+        Returns:
+            The client.
+        """
+        return self
+
+    def __exit__(self, *args: typing.Any) -> None:
+        """Close the client.
+
+        Args:
+            args: Exception type, value and traceback, if any. Exceptions are not suppressed.
+        """
+        self.close()
+
+    def _send(self, command: bytes, data: bytes = b"") -> None:
+        self.sock.sendall(struct.pack("!I", len(data) + 1) + command + data)
+
+    def _recv_exactly(self, size: int) -> bytes:
+        data = b""
+        while len(data) < size:
+            chunk = self.sock.recv(size - len(data))
+            if not chunk:
+                raise MilterError("Connection closed by milter")
+            data += chunk
+        return data
+
+    def _recv(self) -> typing.Tuple[bytes, bytes]:
+        (size,) = struct.unpack("!I", self._recv_exactly(4))
+        if size < 1:
+            raise MilterError("Empty reply from milter")
+        packet = self._recv_exactly(size)
+        return packet[:1], packet[1:]
+
+    def _negotiate(self) -> None:
+        self._send(b"O", struct.pack("!III", SMFI_VERSION, SMFI_ACTIONS, SMFI_PROTOCOL))
+        command, data = self._recv()
+        if command != b"O" or len(data) < 12:
+            raise MilterError(f"Unexpected reply {command!r} to option negotiation")
+        _, _, self.protocol = struct.unpack("!III", data[:12])
+
+    def _step(self, command: bytes, data: bytes = b"") -> str:
+        """Send a step and return the milter's reply, or "continue" if it skipped it."""
+        step = command.decode()
+        if self.protocol & SMFIP_NO.get(step, 0):
+            return "continue"
+        self._send(command, data)
+        if self.protocol & SMFIP_NR.get(step, 0):
+            return "continue"
+        while True:
+            reply, _ = self._recv()
+            if reply != b"p":  # progress
+                break
+        if reply not in REPLIES:
+            raise MilterError(f"Unexpected reply {reply!r} to {step}")
+        return REPLIES[reply]
+
+    def _end_of_message(self) -> typing.Tuple[str, typing.List[typing.Tuple[str, str]]]:
+        """Signal the end of the message and collect the headers the milter adds."""
+        self._send(b"E")
+        headers = []
+        while True:
+            reply, data = self._recv()
+            if reply in (b"h", b"i"):
+                fields = (data[4:] if reply == b"i" else data).split(b"\0")
+                headers.append((fields[0].decode(), fields[1].decode()))
+            elif reply in REPLIES:
+                return REPLIES[reply], headers
+            # Any other modification, such as a body replacement, is ignored.
+
+    def _steps(
+        self, message: bytes, sender: str, recipients: typing.Sequence[str]
+    ) -> typing.List[typing.Tuple[bytes, bytes]]:
+        """Return the protocol steps to pass a message through the milter."""
+        headers, body = split_message(message)
+        steps = []
+        if not self.connected:
+            # Later messages in the session are sent over the same connection.
+            family = b"%d" % ipaddress.ip_address(self.client_address).version
+            connect = self.client_hostname.encode() + b"\0" + family + struct.pack("!H", 25)
+            steps += [
+                (b"C", connect + self.client_address.encode() + b"\0"),
+                (b"H", b"localhost\0"),
+            ]
+            self.connected = True
+        steps += [(b"M", f"<{sender}>".encode() + b"\0")]
+        steps += [(b"R", f"<{rcpt}>".encode() + b"\0") for rcpt in recipients]
+        steps += [(b"T", b"")]
+        steps += [(b"L", f"{n}\0{v}\0".encode("utf-8", "surrogateescape")) for n, v in headers]
+        steps += [(b"N", b"")]
+        steps += [
+            (b"B", body[i : i + BODY_CHUNK_SIZE])  # noqa: E203
+            for i in range(0, len(body), BODY_CHUNK_SIZE)
+        ]
+        return steps
+
+    def send_message(
+        self,
+        message: bytes,
+        sender: str,
+        recipients: typing.Sequence[str],
+        macros: typing.Optional[typing.Mapping[str, str]] = None,
+    ) -> MilterResult:
+        """Pass a message through the milter.
+
+        Args:
+            message: The message, headers and body.
+            sender: Envelope sender.
+            recipients: Envelope recipients.
+            macros: MTA macros, such as "i" (the queue id), sent with MAIL FROM.
+
+        Returns:
+            The final action the milter asked for, and any headers it added.
+        """
+        start = time.perf_counter()
+        macro_data = b"".join(f"{k}\0{v}\0".encode() for k, v in (macros or {}).items())
+        for command, data in self._steps(message, sender, recipients):
+            if command == b"M" and macro_data:
+                self._send(b"D", b"M" + macro_data)
+            action = self._step(command, data)
+            if action == "skip" and command == b"B":
+                break
+            if action != "continue":
+                # Leave the connection ready for another message.
+                self._send(b"A")
+                return MilterResult(action, [], time.perf_counter() - start)
+        action, added = self._end_of_message()
+        return MilterResult(action, added, time.perf_counter() - start)
+
+
+def send_message(
+    milter: typing.Tuple[str, int],
+    message: bytes,
+    sender: str,
+    recipients: typing.Sequence[str],
+    **kwargs: typing.Any,
+) -> MilterResult:
+    """Pass a single message through a milter in a session of its own.
+
+    Args:
+        milter: Address and port the milter listens on.
+        message: The message, headers and body.
+        sender: Envelope sender.
+        recipients: Envelope recipients.
+        kwargs: Passed on to MilterClient, e.g. the timeout.
+
+    Returns:
+        The final action the milter asked for, and any headers it added.
+    """
+    with MilterClient(*milter, **kwargs) as client:
+        return client.send_message(message, sender, recipients)
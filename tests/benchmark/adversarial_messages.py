@@ -0,0 +1,224 @@
+# Copyright 2025 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Check opendkim latency stays bounded under a corpus of adversarial messages.
+
+A local opendkim instance is started with the config the charm renders,
+signing and verifying with the charm's resource limits (maximum_headers,
+maximum_signatures_to_verify and minimum_key_bits), and optionally
+maximum_signed_bytes, which adds an l= tag leaving content past it unsigned.
+A corpus of pathological messages, such as huge header blocks, deeply folded
+headers, many signatures to verify and huge bodies, is passed over milter
+from a number of concurrent sessions alongside ordinary messages. The action
+opendkim takes and the latency of each kind of message are reported, and the
+run fails if any message takes longer than the allowed latency or the milter
+stops responding.
+
+opendkim has to be installed, so run this on a unit or a machine with it.
+
+    $ tox -e benchmark-adversarial -- --rounds 20 --concurrency 8 --max-latency-ms 500
+"""
+
+import argparse
+import concurrent.futures
+import os
+import re
+import shutil
+import statistics
+import subprocess  # nosec B404
+import sys
+import tempfile
+import time
+import typing
+
+import helpers
+
+sys.path.insert(
+    0,
+    os.path.join(
+        os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__)))), "lib"
+    ),
+)
+import milter_client  # noqa: E402
+
+SENDER = "alice@example.test"
+DOMAIN = "example.test"
+
+
+def _message(headers: str = "", body: bytes = b"Hello\r\n") -> bytes:
+    return (
+        f"From: Alice <{SENDER}>\r\n"
+        "To: bob@example.com\r\n"
+        "Subject: Adversarial message\r\n"
+        f"Message-ID: <{time.time()}@{DOMAIN}>\r\n" + headers + "\r\n"
+    ).encode() + body
+
+
+def corpus() -> typing.Dict[str, bytes]:
+    """Build the messages to check.
+
+    Returns:
+        The messages, by name.
+    """
+    signature = (
+        "DKIM-Signature: v=1; a=rsa-sha256; c=relaxed/relaxed; d=s{n}.invalid;"
+        " s=sel; h=from:to:subject; bh=47DEQpj8HBSa+/TImW+5JCeuQeRkm5NMpJWZG3hSuFU=;"
+        " b=AAAA\r\n"
+    )
+    return {
+        "baseline": _message(),
+        "many headers": _message("".join(f"X-Filler-{n}: {n}\r\n" for n in range(5000))),
+        "long header line": _message("X-Long: " + "a" * 1024 * 1024 + "\r\n"),
+        "deeply folded header": _message("X-Folded: a\r\n" + " a\r\n" * 20000),
+        "many signatures": _message("".join(signature.format(n=n) for n in range(100))),
+        "huge body": _message(body=b"The quick brown fox jumps over the lazy dog.\r\n" * 500000),
+        "long body line": _message(body=b"a" * 8 * 1024 * 1024 + b"\r\n"),
+    }
+
+
+def start_opendkim(
+    workdir: str, limits: typing.Mapping[str, int]
+) -> typing.Tuple[subprocess.Popen, int]:
+    """Start an opendkim instance signing and verifying with the resource limits.
+
+    The config is the one the charm renders, listening on a local port.
+
+    Args:
+        workdir: Directory with the signing key, to write the config to.
+        limits: Charm resource limit options and their values, 0 for opendkim's default.
+
+    Returns:
+        The opendkim process and the port it listens on.
+    """
+    port = helpers.free_port()
+    conf = os.path.join(workdir, "opendkim.conf")
+    helpers.render_opendkim_conf(
+        conf,
+        helpers.charm_config(mode="sv", selector="sel", **limits),
+        {"domains": DOMAIN, "internalhosts": "127.0.0.1"},
+        {},
+        keyfile=os.path.join(workdir, "key.private"),
+        pidfile=os.path.join(workdir, "opendkim.pid"),
+        socket=f"inet:{port}@127.0.0.1",
+    )
+    return helpers.start_opendkim(conf, port), port
+
+
+def _check(port: int, name: str, message: bytes, timeout: float) -> typing.Dict[str, typing.Any]:
+    """Pass a message through opendkim in a session of its own and time it."""
+    start = time.perf_counter()
+    try:
+        result = milter_client.send_message(
+            ("127.0.0.1", port), message, SENDER, ["bob@example.com"], timeout=timeout
+        )
+    except (milter_client.MilterError, OSError) as e:
+        return {"name": name, "action": f"error: {e}", "ms": (time.perf_counter() - start) * 1000}
+    signature = next((v for n, v in result.headers if n.lower() == "dkim-signature"), "")
+    return {
+        "name": name,
+        "action": result.action,
+        "ms": result.elapsed * 1000,
+        "signed": bool(signature),
+        "length_tag": bool(re.search(r"(^|;)\s*l=", signature)),
+    }
+
+
+def run(port: int, rounds: int, concurrency: int, timeout: float) -> typing.Dict[str, typing.Any]:
+    """Pass the corpus through opendkim, interleaved with baseline messages.
+
+    Args:
+        port: Port opendkim listens on.
+        rounds: Number of times each message of the corpus is sent.
+        concurrency: Number of concurrent milter sessions.
+        timeout: Seconds to wait for opendkim to reply to each step.
+
+    Returns:
+        Action and latency statistics of each kind of message.
+    """
+    messages = corpus()
+    # Each adversarial message is followed by an ordinary one, so ordinary
+    # mail is measured while workers are busy with the corpus.
+    jobs = [
+        job
+        for _ in range(rounds)
+        for name, message in messages.items()
+        if name != "baseline"
+        for job in ((name, message), ("baseline", messages["baseline"]))
+    ]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(lambda job: _check(port, job[0], job[1], timeout), jobs))
+
+    report: typing.Dict[str, typing.Any] = {}
+    for name in messages:
+        checked = [r for r in results if r["name"] == name]
+        latencies = sorted(r["ms"] for r in checked)
+        report[name] = {
+            "actions": sorted({r["action"] for r in checked}),
+            "signed": sum(r.get("signed", False) for r in checked),
+            "length_tag": sum(r.get("length_tag", False) for r in checked),
+            "p50_ms": statistics.median(latencies),
+            "p95_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+            "max_ms": latencies[-1],
+        }
+    return report
+
+
+def main() -> None:
+    """Run the checks, report the results and exit non-zero if latency was unbounded."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rounds", type=int, default=10, help="times each message is sent")
+    parser.add_argument("--concurrency", type=int, default=4, help="concurrent milter sessions")
+    parser.add_argument(
+        "--max-latency-ms", type=float, default=2000, help="latency no message may exceed"
+    )
+    parser.add_argument("--maximum-headers", type=int, default=65536)
+    parser.add_argument("--maximum-signatures-to-verify", type=int, default=3)
+    parser.add_argument("--maximum-signed-bytes", type=int, default=0)
+    parser.add_argument("--minimum-key-bits", type=int, default=1024)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+    if not shutil.which("opendkim"):
+        sys.exit("opendkim is not installed")
+
+    limits = {
+        "maximum_headers": args.maximum_headers,
+        "maximum_signatures_to_verify": args.maximum_signatures_to_verify,
+        "maximum_signed_bytes": args.maximum_signed_bytes,
+        "minimum_key_bits": args.minimum_key_bits,
+    }
+    workdir = tempfile.mkdtemp(prefix="charm-benchmark-")
+    helpers.hand_to_opendkim(workdir)
+    process = None
+    try:
+        helpers.generate_key(os.path.join(workdir, "key.private"))
+        process, port = start_opendkim(workdir, limits)
+        report = run(port, args.rounds, args.concurrency, args.max_latency_ms / 1000)
+        alive = process.poll() is None
+    finally:
+        if process:
+            process.terminate()
+            process.wait()
+        shutil.rmtree(workdir)
+
+    for name, result in report.items():
+        print(
+            f"{name:<24}{','.join(result['actions']):<20}"
+            f"{result['p50_ms']:>10.2f} ms p50{result['p95_ms']:>10.2f} ms p95"
+            f"{result['max_ms']:>10.2f} ms max"
+        )
+    helpers.write_json(args.json, {"limits": limits, "results": report})
+    slow = [name for name, result in report.items() if result["max_ms"] > args.max_latency_ms]
+    errors = [
+        name
+        for name, result in report.items()
+        if any(action.startswith("error") for action in result["actions"])
+    ]
+    if slow or errors or not alive:
+        sys.exit(
+            f"Latency not bounded: slow {slow or 'none'}, errors {errors or 'none'},"
+            f" opendkim {'running' if alive else 'exited'}"
+        )
+
+
+if __name__ == "__main__":
+    main()
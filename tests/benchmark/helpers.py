@@ -0,0 +1,173 @@
+# Copyright 2025 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Helpers shared by the benchmarks."""
+
+import json
+import os
+import shutil
+import socket
+import subprocess  # nosec B404
+import sys
+import time
+import types
+import typing
+from unittest import mock
+
+import yaml
+
+CHARM_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+
+def charm() -> types.ModuleType:
+    """Import the charm's reactive handlers.
+
+    Returns:
+        The reactive handlers module.
+    """
+    # charms.layer is only available in a built charm.
+    sys.modules.setdefault("charms.layer", mock.MagicMock())
+    for path in (os.path.join(CHARM_DIR, "lib"), CHARM_DIR):
+        if path not in sys.path:
+            sys.path.insert(0, path)
+    # pylint: disable=import-outside-toplevel
+    from reactive import smtp_dkim_signing
+
+    return smtp_dkim_signing
+
+
+def charm_config(**options: typing.Any) -> typing.Dict[str, typing.Any]:
+    """Get the charm's default config, with some options set.
+
+    Args:
+        options: Options to set, and their values.
+
+    Returns:
+        The charm config.
+    """
+    with open(os.path.join(CHARM_DIR, "config.yaml"), "r", encoding="utf-8") as f:
+        defaults = yaml.safe_load(f)["options"]
+    config = {name: option.get("default") for name, option in defaults.items()}
+    config.update(options)
+    return config
+
+
+def free_port() -> int:
+    """Find a local port nothing listens on.
+
+    Returns:
+        The port number.
+    """
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def hand_to_opendkim(path: str) -> None:
+    """Give a file or directory to the opendkim user, as the charm does, if running as root.
+
+    Args:
+        path: Path to the file or directory.
+    """
+    # The charm's config has opendkim switch to its own user once started.
+    if os.geteuid() == 0:
+        shutil.chown(path, "opendkim", "opendkim")
+
+
+def generate_key(path: str) -> None:
+    """Generate an RSA private key readable only by opendkim, as opendkim requires.
+
+    Args:
+        path: Path to write the key to.
+    """
+    subprocess.run(  # nosec B603 B607
+        ["openssl", "genrsa", "-out", path, "2048"], check=True, stderr=subprocess.DEVNULL
+    )
+    os.chmod(path, 0o600)
+    hand_to_opendkim(path)
+
+
+def render_opendkim_conf(
+    path: str,
+    config: typing.Mapping[str, typing.Any],
+    tables: typing.Mapping[str, str],
+    paths: typing.Mapping[str, str],
+    **overrides: typing.Any,
+) -> None:
+    """Render the charm's opendkim config, limits included, as the charm would.
+
+    Args:
+        path: Path to write the config to.
+        config: Charm config to render the config for.
+        tables: Table artifacts, as the charm compiles them.
+        paths: Paths of the tables written out.
+        overrides: Values replacing those of the charm's context, such as the socket.
+    """
+    smtp_dkim_signing = charm()
+    # There is no leader to have published a key rotation outside of Juju.
+    with mock.patch("charmhelpers.core.hookenv.leader_get", return_value={}):
+        context = smtp_dkim_signing._opendkim_context(  # pylint: disable=protected-access
+            config, tables, paths
+        )
+    context.update(overrides)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(
+            smtp_dkim_signing._render_template(  # pylint: disable=protected-access
+                "opendkim_conf.tmpl", context
+            )
+        )
+
+
+def start_opendkim(conf_path: str, port: int) -> subprocess.Popen:
+    """Start opendkim in the foreground and wait for it to listen on its port.
+
+    Args:
+        conf_path: Path to the opendkim config.
+        port: Local port the config has opendkim listen on.
+
+    Returns:
+        The opendkim process.
+
+    Raises:
+        ConnectionRefusedError: if opendkim exited or did not listen within 10 seconds.
+    """
+    process = subprocess.Popen(  # nosec B603 B607 pylint: disable=consider-using-with
+        ["opendkim", "-f", "-x", conf_path]
+    )
+    deadline = time.time() + 10
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return process
+        except ConnectionRefusedError:
+            if time.time() > deadline or process.poll() is not None:
+                process.kill()
+                raise
+            time.sleep(0.1)
+
+
+def cpu_seconds(process: subprocess.Popen) -> float:
+    """Get the CPU time a process used so far.
+
+    Args:
+        process: The process, still running.
+
+    Returns:
+        The user and system CPU time, in seconds.
+    """
+    with open(f"/proc/{process.pid}/stat", "r", encoding="utf-8") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    # utime and stime are the 14th and 15th fields.
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def write_json(path: typing.Optional[str], results: typing.Mapping[str, typing.Any]) -> None:
+    """Write the results to a JSON file, if one was asked for.
+
+    Args:
+        path: Path to the file, or None not to write one.
+        results: Results to write.
+    """
+    if path:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
@@ -0,0 +1,157 @@
+# Copyright 2025 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Benchmark the charm's start up and hook run times.
+
+Every hook starts a fresh interpreter and imports the reactive handlers, so
+import time is measured in new interpreters. Handler run times are measured
+with the Juju hook tools mocked out, as in the unit tests.
+
+    $ tox -e benchmark -- --runs 20 --json bench.json
+"""
+
+import argparse
+import os
+import shutil
+import statistics
+import subprocess  # nosec B404
+import sys
+import tempfile
+import time
+import typing
+from unittest import mock
+
+import helpers
+
+CHARM_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+# charms.layer is only available in a built charm, so stub it out as cheaply
+# as possible to not skew the import time.
+IMPORT_SNIPPET = """
+import sys, time, types
+layer = types.ModuleType("charms.layer")
+layer.status = types.SimpleNamespace()
+sys.modules["charms.layer"] = layer
+sys.path.insert(0, {charm_dir!r})
+sys.path.insert(0, {charm_dir!r} + "/lib")
+start = time.perf_counter()
+from reactive import smtp_dkim_signing
+print(time.perf_counter() - start, "jinja2" in sys.modules)
+"""
+
+
+def measure_import(runs: int) -> typing.Dict[str, typing.Any]:
+    """Measure the time to import the reactive handlers in fresh interpreters.
+
+    Args:
+        runs: Number of interpreters to start.
+
+    Returns:
+        Import time statistics, in milliseconds.
+    """
+    timings = []
+    jinja2_imported = False
+    for _ in range(runs):
+        output = subprocess.check_output(  # nosec B603
+            [sys.executable, "-c", IMPORT_SNIPPET.format(charm_dir=CHARM_DIR)], text=True
+        )
+        elapsed, imported = output.split()
+        timings.append(float(elapsed) * 1000)
+        jinja2_imported |= imported == "True"
+    return {
+        "median_ms": statistics.median(timings),
+        "max_ms": max(timings),
+        "jinja2_imported": jinja2_imported,
+    }
+
+
+def _time(func: typing.Callable[[], typing.Any], runs: int) -> typing.Dict[str, float]:
+    """Time a handler over a number of runs."""
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return {"median_ms": statistics.median(timings), "max_ms": max(timings)}
+
+
+def measure_hooks(runs: int) -> typing.Dict[str, typing.Dict[str, float]]:
+    """Measure the run time of the handlers with the hook tools mocked.
+
+    Args:
+        runs: Number of times to run each handler.
+
+    Returns:
+        Run time statistics per handler, in milliseconds.
+    """
+    sys.modules.setdefault("charms.layer", mock.MagicMock())
+    sys.path.insert(0, CHARM_DIR)
+    sys.path.insert(0, os.path.join(CHARM_DIR, "lib"))
+    # pylint: disable=import-outside-toplevel
+    from charmhelpers.core import unitdata
+
+    from reactive import smtp_dkim_signing
+
+    tmpdir = tempfile.mkdtemp(prefix="charm-benchmark-")
+    os.environ["UNIT_STATE_DB"] = os.path.join(tmpdir, ".unit-state.db")
+    unitdata._KV = None  # pylint: disable=protected-access
+    config = {"domains": "myawsomedomain.local", "mode": "sv", "selector": "20210622"}
+    conf_path = os.path.join(tmpdir, "opendkim.conf")
+    patches = [
+        mock.patch("charmhelpers.core.hookenv.config", return_value=config),
+        mock.patch("charmhelpers.core.hookenv.is_leader", return_value=True),
+        mock.patch("charmhelpers.core.hookenv.leader_get", return_value={}),
+        mock.patch("charmhelpers.core.hookenv.leader_set"),
+        mock.patch("charmhelpers.core.hookenv.local_unit", return_value="smtp-dkim-signing/0"),
+        mock.patch("charmhelpers.core.hookenv.log"),
+        mock.patch("charmhelpers.core.hookenv.network_get", return_value={}),
+        mock.patch("charmhelpers.core.hookenv.open_port"),
+        mock.patch(
+            "charmhelpers.core.hookenv.relation_ids",
+            side_effect=lambda endpoint: ["milter:1"] if endpoint == "milter" else [],
+        ),
+        mock.patch("charmhelpers.core.hookenv.relation_set"),
+        mock.patch("charmhelpers.core.hookenv.resource_get", return_value=False),
+        mock.patch("charmhelpers.core.hookenv.unit_private_ip", return_value="10.0.0.10"),
+        mock.patch("charmhelpers.core.host.log"),
+        mock.patch("charmhelpers.core.host.service_reload"),
+        mock.patch("charmhelpers.core.host.service_start"),
+        mock.patch("charms.reactive.clear_flag"),
+        mock.patch("charms.reactive.set_flag"),
+    ]
+    for patch in patches:
+        patch.start()
+    try:
+        return {
+            "configure (first)": _time(
+                lambda: smtp_dkim_signing.configure_smtp_dkim_signing(conf_path, tmpdir, ""), 1
+            ),
+            "configure (no change)": _time(
+                lambda: smtp_dkim_signing.configure_smtp_dkim_signing(conf_path, tmpdir, ""), runs
+            ),
+            "milter_notify": _time(smtp_dkim_signing.milter_notify, runs),
+            "update-status": _time(lambda: smtp_dkim_signing.retire_rotated_key(tmpdir), runs),
+        }
+    finally:
+        for patch in patches:
+            patch.stop()
+        shutil.rmtree(tmpdir)
+
+
+def main() -> None:
+    """Run the benchmarks and report the results."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10, help="runs per measurement")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    results = {"import": measure_import(args.runs), "hooks": measure_hooks(args.runs)}
+    print(f"{'import':<24}{results['import']['median_ms']:>10.2f} ms (median)")
+    print(f"{'':<24}jinja2 imported: {results['import']['jinja2_imported']}")
+    for name, timings in results["hooks"].items():
+        print(f"{name:<24}{timings['median_ms']:>10.2f} ms (median)")
+    helpers.write_json(args.json, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+# Copyright 2025 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Benchmark signing with two keys in one milter pass against two chained milters.
+
+Local opendkim instances are started with two keys, a tenant's and the
+platform's: one with MultipleSignatures enabled signing with both, and two
+signing with one key each, which messages pass through in turn as with
+chained milters. Messages are passed over milter from a number of concurrent
+sessions and the throughput, latency and opendkim CPU time per message of
+both set ups are reported.
+
+opendkim has to be installed, so run this on a unit or a machine with it.
+
+    $ tox -e benchmark-signatures -- --messages 5000 --concurrency 8 --json bench.json
+"""
+
+import argparse
+import concurrent.futures
+import os
+import shutil
+import statistics
+import subprocess  # nosec B404
+import sys
+import tempfile
+import time
+import typing
+
+import helpers
+
+sys.path.insert(
+    0,
+    os.path.join(
+        os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__)))), "lib"
+    ),
+)
+import milter_client  # noqa: E402
+
+KEYS = {"tenant": "tenant.example", "platform": "platform.example"}
+SENDER = "alice@tenant.example"
+
+
+def _write(path: str, contents: str, perms: int = 0o644) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(contents)
+    os.chmod(path, perms)
+
+
+def start_opendkim(
+    workdir: str, name: str, keys: typing.Sequence[str]
+) -> typing.Tuple[subprocess.Popen, int]:
+    """Start an opendkim instance signing messages from SENDER with the keys.
+
+    The config is the one the charm renders, listening on a local port.
+
+    Args:
+        workdir: Directory with the keys, to write the config to.
+        name: Name of the instance.
+        keys: Names of the keys to sign with.
+
+    Returns:
+        The opendkim process and the port it listens on.
+    """
+    port = helpers.free_port()
+    keytable = "".join(
+        f"{key} {domain}:{key}:{os.path.join(workdir, key)}.private\n"
+        for key, domain in KEYS.items()
+    )
+    _write(os.path.join(workdir, f"{name}.keytable"), keytable)
+    _write(
+        os.path.join(workdir, f"{name}.signingtable"),
+        "".join(f"*@{SENDER.split('@')[1]} {key}\n" for key in keys),
+    )
+    helpers.render_opendkim_conf(
+        os.path.join(workdir, f"{name}.conf"),
+        helpers.charm_config(mode="s", selector=keys[0], multiple_signatures=len(keys) > 1),
+        {"domains": ",".join(KEYS.values()), "internalhosts": "127.0.0.1"},
+        {
+            "keytable": os.path.join(workdir, f"{name}.keytable"),
+            "signingtable": os.path.join(workdir, f"{name}.signingtable"),
+        },
+        keyfile=os.path.join(workdir, f"{keys[0]}.private"),
+        pidfile=os.path.join(workdir, f"{name}.pid"),
+        socket=f"inet:{port}@127.0.0.1",
+    )
+    return helpers.start_opendkim(os.path.join(workdir, f"{name}.conf"), port), port
+
+
+def _message(body_size: int, n: int) -> bytes:
+    line = "The quick brown fox jumps over the lazy dog. " * 2 + "\r\n"
+    return (
+        f"From: Alice <{SENDER}>\r\n"
+        "To: bob@example.com\r\n"
+        f"Subject: Benchmark message {n}\r\n"
+        f"Message-ID: <{n}.{time.time()}@tenant.example>\r\n"
+        "\r\n" + line * (body_size // len(line) + 1)
+    ).encode()
+
+
+def _sign(
+    clients: typing.Sequence[milter_client.MilterClient], message: bytes
+) -> typing.Tuple[float, int]:
+    """Pass a message through the milters in turn, as chained milters would."""
+    start = time.perf_counter()
+    signatures = 0
+    for client in clients:
+        result = client.send_message(message, SENDER, ["bob@example.com"])
+        added = "".join(f"{name}: {value}\r\n" for name, value in result.headers)
+        message = added.encode() + message
+        signatures += sum(name.lower() == "dkim-signature" for name, _ in result.headers)
+    return time.perf_counter() - start, signatures
+
+
+def run(
+    ports: typing.Sequence[int], messages: int, concurrency: int, body_size: int
+) -> typing.Dict[str, float]:
+    """Sign messages through the milters listening on the ports.
+
+    Args:
+        ports: Ports of the milters messages pass through, in turn.
+        messages: Number of messages to sign.
+        concurrency: Number of concurrent milter sessions.
+        body_size: Size of the message bodies, in bytes.
+
+    Returns:
+        Throughput and latency statistics.
+    """
+
+    def session(count: int) -> typing.List[typing.Tuple[float, int]]:
+        clients = [milter_client.MilterClient("127.0.0.1", port) for port in ports]
+        try:
+            return [_sign(clients, _message(body_size, n)) for n in range(count)]
+        finally:
+            for client in clients:
+                client.close()
+
+    counts = [messages // concurrency + (i < messages % concurrency) for i in range(concurrency)]
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = [r for rs in executor.map(session, counts) for r in rs]
+    elapsed = time.perf_counter() - start
+    latencies = sorted(latency * 1000 for latency, _ in results)
+    return {
+        "messages_per_sec": messages / elapsed,
+        "p50_ms": statistics.median(latencies),
+        "p95_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+        "signatures_per_message": sum(s for _, s in results) / len(results),
+    }
+
+
+def main() -> None:
+    """Run the benchmarks and report the results."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=1000, help="messages to sign")
+    parser.add_argument("--concurrency", type=int, default=4, help="concurrent milter sessions")
+    parser.add_argument("--body-size", type=int, default=16384, help="message body size, bytes")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+    if not shutil.which("opendkim"):
+        sys.exit("opendkim is not installed")
+
+    workdir = tempfile.mkdtemp(prefix="charm-benchmark-")
+    helpers.hand_to_opendkim(workdir)
+    processes = []
+    try:
+        for key in KEYS:
+            helpers.generate_key(os.path.join(workdir, f"{key}.private"))
+        setups = {
+            "multiple signatures": [start_opendkim(workdir, "multiple", list(KEYS))],
+            "chained milters": [start_opendkim(workdir, key, [key]) for key in KEYS],
+        }
+        processes = [process for setup in setups.values() for process, _ in setup]
+
+        results = {}
+        for name, setup in setups.items():
+            cpu = sum(helpers.cpu_seconds(process) for process, _ in setup)
+            ports = [port for _, port in setup]
+            results[name] = run(ports, args.messages, args.concurrency, args.body_size)
+            cpu = sum(helpers.cpu_seconds(process) for process, _ in setup) - cpu
+            results[name]["opendkim_cpu_ms_per_message"] = cpu * 1000 / args.messages
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+        shutil.rmtree(workdir)
+
+    for name, result in results.items():
+        print(
+            f"{name:<24}{result['messages_per_sec']:>10.1f} msg/s"
+            f"{result['p50_ms']:>10.2f} ms p50{result['p95_ms']:>10.2f} ms p95"
+            f"{result['opendkim_cpu_ms_per_message']:>10.3f} CPU ms/msg"
+        )
+    helpers.write_json(args.json, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+# Copyright 2025 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Unit tests for the SMTP DKIM signing charm actions."""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+# We also need to mock up charms.layer so we can run unit tests without having
+# to build the charm and pull in layers such as layer-status.
+sys.modules.setdefault("charms.layer", mock.MagicMock())
+
+from charmhelpers.core import unitdata  # NOQA: E402
+
+# Add path to where our actions and libraries live and import.
+CHARM_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+sys.path.append(CHARM_DIR)
+sys.path.append(os.path.join(CHARM_DIR, "lib"))
+from actions import actions  # NOQA: E402
+
+# pylint: disable=unused-argument
+
+
+class TestActions(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="charm-unittests-")
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        os.environ["UNIT_STATE_DB"] = os.path.join(self.tmpdir, ".unit-state.db")
+        unitdata._KV = None  # pylint: disable=protected-access
+
+        patcher = mock.patch("charmhelpers.core.hookenv.action_fail")
+        self.mock_action_fail = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        patcher = mock.patch("charmhelpers.core.hookenv.action_set")
+        self.mock_action_set = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @mock.patch("charmhelpers.core.hookenv.action_get")
+    @mock.patch("reactive.smtp_dkim_signing.audit_signing_keys")
+    def test_audit_keys(self, audit_signing_keys, action_get):
+        action_get.return_value = {"seconds": 2, "top": 2}
+        audit_signing_keys.return_value = [
+            {"path": "/etc/dkimkeys/bad.private", "tenants": [], "error": "unable to parse"},
+            {
+                "algorithm": "rsa",
+                "bits": 4096,
+                "fingerprint": "SHA256:abc",
+                "path": "/etc/dkimkeys/big.private",
+                "signs_per_sec": 500.0,
+                "tenants": ["a.local", "b.local"],
+            },
+            {
+                "algorithm": "rsa",
+                "bits": 2048,
+                "fingerprint": "SHA256:def",
+                "path": "/etc/dkimkeys/mail.private",
+                "signs_per_sec": 2000.0,
+                "tenants": ["c.local"],
+            },
+        ]
+        actions.main(["actions/audit-keys"])
+        audit_signing_keys.assert_called_once_with(seconds=2.0)
+        self.mock_action_set.assert_called_once_with(
+            {
+                "keys": "/etc/dkimkeys/bad.private: unable to parse\n"
+                "/etc/dkimkeys/big.private: rsa 4096 bits, 500 signatures/sec, SHA256:abc"
+                ", tenants: a.local, b.local\n"
+                "/etc/dkimkeys/mail.private: rsa 2048 bits, 2000 signatures/sec, SHA256:def"
+                ", tenants: c.local",
+                "most-expensive": "a.local: 2.000 ms/signature (/etc/dkimkeys/big.private)\n"
+                "b.local: 2.000 ms/signature (/etc/dkimkeys/big.private)",
+            }
+        )
+        self.mock_action_fail.assert_not_called()
+
+    @mock.patch("reactive.smtp_dkim_signing.dkim_dns_records")
+    def test_get_dns_records(self, dkim_dns_records):
+        dkim_dns_records.return_value = {
+            "active": [
+                'mail._domainkey.a.local. IN TXT "v=DKIM1"',
+                'mail._domainkey.b.local. IN TXT "v=DKIM1"',
+            ]
+        }
+        actions.main(["actions/get-dns-records"])
+        self.mock_action_set.assert_called_once_with(
+            {
+                "active": 'mail._domainkey.a.local. IN TXT "v=DKIM1"\n'
+                'mail._domainkey.b.local. IN TXT "v=DKIM1"'
+            }
+        )
+        self.mock_action_fail.assert_not_called()
+
+    @mock.patch("reactive.smtp_dkim_signing.milter_proxy_stats")
+    def test_milter_proxy_stats(self, milter_proxy_stats):
+        milter_proxy_stats.return_value = {
+            "workers": {
+                "worker-2": {"draining": True, "errors": 0, "outstanding": 1, "sessions": 7},
+                "worker-1": {"draining": False, "errors": 2, "outstanding": 3, "sessions": 9},
+            }
+        }
+        actions.main(["actions/milter-proxy-stats"])
+        self.mock_action_set.assert_called_once_with(
+            {
+                "workers": "worker-1: 3 outstanding, 9 sessions, 2 errors\n"
+                "worker-2: 1 outstanding, 7 sessions, 0 errors, draining"
+            }
+        )
+        self.mock_action_fail.assert_not_called()
+
+        self.mock_action_set.reset_mock()
+        milter_proxy_stats.return_value = {}
+        actions.main(["actions/milter-proxy-stats"])
+        self.mock_action_set.assert_not_called()
+        self.mock_action_fail.assert_called_once()
+
+    @mock.patch("reactive.smtp_dkim_signing.configure_smtp_dkim_signing")
+    @mock.patch("reactive.smtp_dkim_signing.rotate_signing_key")
+    def test_rotate_key(self, rotate_signing_key, configure_smtp_dkim_signing):
+        rotate_signing_key.return_value = {"previous": "mail", "selector": "mail2"}
+        actions.main(["actions/rotate-key"])
+        configure_smtp_dkim_signing.assert_called_once_with()
+        self.mock_action_set.assert_called_once_with({"previous": "mail", "selector": "mail2"})
+        self.mock_action_fail.assert_not_called()
+
+    @mock.patch("reactive.smtp_dkim_signing.configure_smtp_dkim_signing")
+    @mock.patch("reactive.smtp_dkim_signing.rotate_signing_key")
+    def test_rotate_key_not_staged(self, rotate_signing_key, configure_smtp_dkim_signing):
+        rotate_signing_key.side_effect = ValueError("No rotation_selector configured")
+        actions.main(["actions/rotate-key"])
+        configure_smtp_dkim_signing.assert_not_called()
+        self.mock_action_fail.assert_called_once_with("No rotation_selector configured")
@@ -0,0 +1,184 @@
+# Copyright 2025 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Unit tests for the offline DKIM archive check tool."""
+
+import contextlib
+import io
+import json
+import mailbox
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+# Add path to where the tool lives and import.
+sys.path.append(
+    os.path.join(
+        os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__)))), "files"
+    )
+)
+import dkim  # NOQA: E402
+import dkim_archive_check  # NOQA: E402
+
+MESSAGE = (
+    "From: Alice <alice@{domain}>\r\n"
+    "To: bob@example.com\r\n"
+    "Subject: Test {n}\r\n"
+    "Message-ID: <{n}@{domain}>\r\n"
+    "\r\n"
+    "Hello {n}\r\n"
+)
+
+
+class TestDkimArchiveCheck(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="charm-unittests-")
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.keyfile = os.path.join(
+            os.path.dirname(os.path.realpath(__file__)), "files", "rotation_key.private"
+        )
+        with open(self.keyfile, "rb") as f:
+            self.key = f.read()
+
+        keytable = os.path.join(self.tmpdir, "keytable")
+        with open(keytable, "w", encoding="utf-8") as f:
+            f.write(f"mail._domainkey.tenant.local tenant.local:mail:{self.keyfile}\n")
+        signingtable = os.path.join(self.tmpdir, "signingtable")
+        with open(signingtable, "w", encoding="utf-8") as f:
+            f.write("# Tenant\n*@tenant.local mail._domainkey.tenant.local\n")
+        self.conf = os.path.join(self.tmpdir, "opendkim.conf")
+        with open(self.conf, "w", encoding="utf-8") as f:
+            f.write(
+                "# This file is Juju managed - do not edit by hand #\n\n"
+                "Canonicalization relaxed/relaxed\n"
+                "Domain example.local\n"
+                f"KeyFile {self.keyfile}\n"
+                "Selector 20210622\n"
+                f"KeyTable file:{keytable}\n"
+                f"SigningTable refile:{signingtable}\n"
+                "SignHeaders From,To,Subject,Message-ID\n"
+            )
+
+    def _message(self, domain, n):
+        return MESSAGE.format(domain=domain, n=n).encode()
+
+    def _sign(self, message, domain="example.local", selector="20210622"):
+        return (
+            dkim.sign(
+                message,
+                selector.encode(),
+                domain.encode(),
+                self.key,
+                canonicalize=(b"relaxed", b"relaxed"),
+            )
+            + message
+        )
+
+    def _run(self, *args):
+        stdout = io.StringIO()
+        with contextlib.redirect_stdout(stdout):
+            ret = dkim_archive_check.main(["--conf", self.conf, "--workers", "2", "--json", *args])
+        return ret, json.loads(stdout.getvalue())
+
+    def test_load_signers(self):
+        context = dkim_archive_check.load_signers(dkim_archive_check.read_opendkim_conf(self.conf))
+        self.assertEqual((b"relaxed", b"relaxed"), context["canonicalize"])
+        self.assertEqual(["example.local"], context["domains"])
+        self.assertEqual([b"from", b"to", b"subject", b"message-id"], context["headers"])
+        self.assertFalse(context["multiple"])
+
+        signers = dkim_archive_check.choose_signers("alice@tenant.local", context)
+        self.assertEqual([("tenant.local", "mail")], [s[:2] for s in signers])
+        signers = dkim_archive_check.choose_signers("alice@example.local", context)
+        self.assertEqual([("example.local", "20210622")], [s[:2] for s in signers])
+        self.assertEqual([], dkim_archive_check.choose_signers("alice@other.local", context))
+
+    def test_load_signers_tabs(self):
+        with open(os.path.join(self.tmpdir, "keytable"), "w", encoding="utf-8") as f:
+            f.write(
+                "# Tenants\n\n"
+                f"mail._domainkey.tenant.local\ttenant.local:mail:{self.keyfile}\n"
+                f"  mail._domainkey.other.local \t other.local:mail:{self.keyfile}\n"
+            )
+        with open(os.path.join(self.tmpdir, "signingtable"), "w", encoding="utf-8") as f:
+            f.write("*@tenant.local\tmail._domainkey.tenant.local\n")
+        context = dkim_archive_check.load_signers(dkim_archive_check.read_opendkim_conf(self.conf))
+        self.assertEqual(
+            ["mail._domainkey.other.local", "mail._domainkey.tenant.local"],
+            sorted(context["keytable"]),
+        )
+        signers = dkim_archive_check.choose_signers("alice@tenant.local", context)
+        self.assertEqual([("tenant.local", "mail")], [s[:2] for s in signers])
+
+    def test_load_signers_malformed(self):
+        keytable = os.path.join(self.tmpdir, "keytable")
+        with open(keytable, "w", encoding="utf-8") as f:
+            f.write(f"# Tenants\nmail._domainkey.tenant.local\ttenant.local:{self.keyfile}\n")
+        stderr = io.StringIO()
+        with contextlib.redirect_stderr(stderr):
+            ret = dkim_archive_check.main(["--conf", self.conf, "sign", self.tmpdir])
+        self.assertEqual(2, ret)
+        self.assertEqual(f"{keytable}:2: malformed KeyTable entry\n", stderr.getvalue())
+
+    def test_build_key_map(self):
+        zone_file = os.path.join(self.tmpdir, "records.zone")
+        with open(zone_file, "w", encoding="utf-8") as f:
+            f.write('sel._domainkey.Other.local. IN TXT "v=DKIM1; k=rsa; " "p=ABC"\n')
+        context = dkim_archive_check.load_signers(dkim_archive_check.read_opendkim_conf(self.conf))
+        key_map = dkim_archive_check.build_key_map(context, [zone_file])
+
+        self.assertEqual(
+            ["20210622._domainkey.example.local", "mail._domainkey.tenant.local"],
+            sorted(key_map)[:2],
+        )
+        self.assertTrue(key_map["mail._domainkey.tenant.local"].startswith(b"v=DKIM1; k=rsa; p="))
+        self.assertEqual(
+            key_map["mail._domainkey.tenant.local"], key_map["20210622._domainkey.example.local"]
+        )
+        self.assertEqual(b"v=DKIM1; k=rsa; p=ABC", key_map["sel._domainkey.other.local"])
+
+    def test_sign_maildir(self):
+        archive = mailbox.Maildir(os.path.join(self.tmpdir, "Maildir"))
+        for n in range(5):
+            archive.add(self._message("tenant.local", n))
+        for n in range(3):
+            archive.add(self._message("example.local", n))
+        archive.add(self._message("other.local", 0))
+
+        ret, report = self._run("sign", os.path.join(self.tmpdir, "Maildir"))
+        self.assertEqual(0, ret)
+        self.assertEqual(9, report["messages"])
+        self.assertEqual(["example.local", "other.local", "tenant.local"], list(report["domains"]))
+        self.assertEqual(3, report["domains"]["example.local"]["pass"])
+        self.assertEqual(1, report["domains"]["other.local"]["none"])
+        self.assertEqual(5, report["domains"]["tenant.local"]["pass"])
+        self.assertLessEqual(
+            report["domains"]["tenant.local"]["p50_ms"],
+            report["domains"]["tenant.local"]["max_ms"],
+        )
+
+    def test_verify_mbox(self):
+        archive = mailbox.mbox(os.path.join(self.tmpdir, "archive.mbox"))
+        for n in range(4):
+            archive.add(self._sign(self._message("example.local", n)))
+        archive.add(self._sign(self._message("example.local", 4)).replace(b"Hello", b"Bye"))
+        archive.add(self._message("example.local", 5))
+        archive.flush()
+
+        ret, report = self._run("verify", os.path.join(self.tmpdir, "archive.mbox"))
+        self.assertEqual(1, ret)
+        self.assertEqual(
+            {"pass": 4, "fail": 1, "none": 1},
+            {k: report["domains"]["example.local"][k] for k in ("pass", "fail", "none")},
+        )
+
+    def test_verify_unknown_key(self):
+        archive = mailbox.mbox(os.path.join(self.tmpdir, "archive.mbox"))
+        archive.add(self._sign(self._message("other.local", 0), "other.local", "sel"))
+        archive.flush()
+
+        ret, report = self._run("verify", os.path.join(self.tmpdir, "archive.mbox"))
+        self.assertEqual(1, ret)
+        self.assertEqual(1, report["domains"]["other.local"]["fail"])
@@ -0,0 +1,158 @@
+# Copyright 2025 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Unit tests for the milter protocol client."""
+
+import os
+import socket
+import struct
+import sys
+import threading
+import unittest
+
+# Add path to where our libraries live and import.
+sys.path.append(
+    os.path.join(
+        os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__)))), "lib"
+    )
+)
+import milter_client  # NOQA: E402
+
+MESSAGE = b"From: Alice <alice@example.com>\nSubject: A long\n  subject\n\nHello\n"
+
+
+class FakeMilter(threading.Thread):
+    """A milter that records the steps it is sent and signs at end of message."""
+
+    def __init__(self, protocol=0, replies=None):
+        """Listen on a free local port.
+
+        Args:
+            protocol: Protocol flags to negotiate, such as steps not to reply to.
+            replies: Reply to send to each command, instead of continue.
+        """
+        super().__init__(daemon=True)
+        self.server = socket.create_server(("127.0.0.1", 0))
+        self.port = self.server.getsockname()[1]
+        self.protocol = protocol
+        self.replies = replies or {}
+        self.steps = []
+
+    def _recv(self, conn, size):
+        data = b""
+        while len(data) < size:
+            chunk = conn.recv(size - len(data))
+            if not chunk:
+                raise EOFError
+            data += chunk
+        return data
+
+    def _send(self, conn, command, data=b""):
+        conn.sendall(struct.pack("!I", len(data) + 1) + command + data)
+
+    def run(self):
+        conn, _ = self.server.accept()
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        with conn:
+            try:
+                while True:
+                    (size,) = struct.unpack("!I", self._recv(conn, 4))
+                    packet = self._recv(conn, size)
+                    command, data = packet[:1], packet[1:]
+                    self.steps.append((command, data))
+                    self._reply(conn, command)
+            except EOFError:
+                pass
+        self.server.close()
+
+    def _reply(self, conn, command):
+        if command == b"O":
+            self._send(conn, b"O", struct.pack("!III", 6, 0x1FF, self.protocol))
+        elif command == b"E":
+            self._send(conn, b"i", struct.pack("!I", 1) + b"DKIM-Signature\0v=1; d=example.com\0")
+            self._send(conn, b"c")
+        elif command in (b"D", b"A", b"Q") or (command == b"L" and self.protocol & 0x80):
+            return
+        else:
+            self._send(conn, b"p")
+            self._send(conn, self.replies.get(command, b"c"))
+
+
+class TestMilterClient(unittest.TestCase):
+    def _milter(self, **kwargs):
+        milter = FakeMilter(**kwargs)
+        milter.start()
+        self.addCleanup(milter.join, 5)
+        return milter
+
+    def test_split_message(self):
+        headers, body = milter_client.split_message(MESSAGE)
+        self.assertEqual(
+            [("From", "Alice <alice@example.com>"), ("Subject", "A long\r\n  subject")], headers
+        )
+        self.assertEqual(b"Hello\r\n", body)
+
+    def test_send_message(self):
+        milter = self._milter(protocol=0x80)  # no replies to headers
+        result = milter_client.send_message(
+            ("127.0.0.1", milter.port), MESSAGE, "alice@example.com", ["bob@example.com"]
+        )
+        self.assertEqual("continue", result.action)
+        self.assertEqual([("DKIM-Signature", "v=1; d=example.com")], result.headers)
+        milter.join(5)
+        self.assertEqual(
+            [b"O", b"C", b"H", b"M", b"R", b"T", b"L", b"L", b"N", b"B", b"E", b"Q"],
+            [command for command, _ in milter.steps],
+        )
+        self.assertEqual(b"localhost\x004\x00\x19127.0.0.1\x00", milter.steps[1][1])
+        self.assertEqual(b"<alice@example.com>\0", milter.steps[3][1])
+        self.assertEqual(b"Subject\0A long\r\n  subject\0", milter.steps[7][1])
+        self.assertEqual(b"Hello\r\n", milter.steps[9][1])
+
+    def test_send_message_rejected(self):
+        milter = self._milter(replies={b"R": b"t"})
+        with milter_client.MilterClient("127.0.0.1", milter.port) as client:
+            result = client.send_message(
+                MESSAGE, "alice@example.com", ["bob@example.com"], macros={"i": "ABC123"}
+            )
+            self.assertEqual("tempfail", result.action)
+            self.assertEqual([], result.headers)
+            # The session can go on with the next message.
+            milter.replies = {}
+            result = client.send_message(MESSAGE, "alice@example.com", ["carol@example.com"])
+            self.assertEqual("continue", result.action)
+        milter.join(5)
+        commands = [command for command, _ in milter.steps]
+        self.assertEqual([b"O", b"C", b"H", b"D", b"M", b"R", b"A", b"M"], commands[:8])
+        self.assertEqual(b"Mi\0ABC123\0", milter.steps[3][1])
+        self.assertEqual(1, commands.count(b"C"))
+
+    def test_send_message_ipv6_client(self):
+        milter = self._milter()
+        milter_client.send_message(
+            ("127.0.0.1", milter.port),
+            MESSAGE,
+            "alice@example.com",
+            ["bob@example.com"],
+            client_address="2001:db8::1",
+            client_hostname="mail.example.com",
+        )
+        milter.join(5)
+        self.assertEqual(b"mail.example.com\x006\x00\x192001:db8::1\x00", milter.steps[1][1])
+
+    def test_send_message_closed(self):
+        server = socket.create_server(("127.0.0.1", 0))
+        self.addCleanup(server.close)
+
+        def close():
+            conn, _ = server.accept()
+            conn.recv(17)
+            conn.close()
+
+        thread = threading.Thread(target=close, daemon=True)
+        thread.start()
+        with self.assertRaises(milter_client.MilterError):
+            milter_client.send_message(
+                server.getsockname(), MESSAGE, "alice@example.com", ["bob@example.com"]
+            )
+        thread.join(5)
@@ -0,0 +1,173 @@
+# Copyright 2025 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Unit tests for the milter front proxy."""
+
+import asyncio
+import json
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import unittest
+
+# Add path to where the proxy lives and import.
+sys.path.append(
+    os.path.join(
+        os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__)))), "files"
+    )
+)
+import milter_proxy  # NOQA: E402
+
+
+async def _echo(reader, writer):
+    while True:
+        data = await reader.read(1024)
+        if not data:
+            break
+        writer.write(data)
+        await writer.drain()
+    writer.close()
+
+
+class TestMilterProxy(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="charm-unittests-")
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.config_path = os.path.join(self.tmpdir, "milter-proxy.json")
+        self.stats_path = os.path.join(self.tmpdir, "stats.json")
+
+    def _write_config(self, workers, draining=()):
+        with open(self.config_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "port": 0,
+                    "stats": self.stats_path,
+                    "workers": [{"name": name, "port": port} for name, port in workers.items()],
+                    "draining": list(draining),
+                },
+                f,
+            )
+
+    def _stats(self):
+        with open(self.stats_path, "r", encoding="utf-8") as f:
+            return json.load(f)["workers"]
+
+    async def _session(self, port):
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(b"ping")
+        self.assertEqual(b"ping", await reader.readexactly(4))
+        return writer
+
+    def test_balance_and_drain(self):
+        async def run():
+            workers = {}
+            for name in ("worker-1", "worker-2"):
+                server = await asyncio.start_server(_echo, "127.0.0.1", 0)
+                workers[name] = server.sockets[0].getsockname()[1]
+            self._write_config(workers)
+            proxy = milter_proxy.MilterProxy(self.config_path)
+            server = await asyncio.start_server(proxy.handle, "127.0.0.1", 0)
+            port = server.sockets[0].getsockname()[1]
+
+            # Sessions go to the worker with the fewest outstanding.
+            sessions = [await self._session(port) for _ in range(3)]
+            self.assertEqual(
+                {"worker-1": 2, "worker-2": 1},
+                {name: w.outstanding for name, w in proxy.workers.items()},
+            )
+
+            # Draining workers get no new sessions, but keep their current ones.
+            self._write_config(workers, draining=["worker-1"])
+            proxy.reload()
+            sessions.append(await self._session(port))
+            proxy.write_stats()
+            stats = self._stats()
+            self.assertTrue(stats["worker-1"]["draining"])
+            self.assertEqual(2, stats["worker-1"]["outstanding"])
+            self.assertEqual(2, stats["worker-2"]["outstanding"])
+
+            for session in sessions:
+                session.close()
+            for _ in range(50):
+                if not any(w.outstanding for w in proxy.workers.values()):
+                    break
+                await asyncio.sleep(0.01)
+            proxy.write_stats()
+            self.assertEqual(
+                {"worker-1": (0, 2), "worker-2": (0, 2)},
+                {name: (w["outstanding"], w["sessions"]) for name, w in self._stats().items()},
+            )
+            server.close()
+
+        asyncio.run(run())
+
+    def test_session_across_reconfigure(self):
+        async def run():
+            workers = {}
+            for name in ("worker-1", "worker-2"):
+                server = await asyncio.start_server(_echo, "127.0.0.1", 0)
+                workers[name] = server.sockets[0].getsockname()[1]
+            self._write_config(workers)
+            proxy = milter_proxy.MilterProxy(self.config_path)
+            server = await asyncio.start_server(proxy.handle, "127.0.0.1", 0)
+            port = server.sockets[0].getsockname()[1]
+
+            # Sessions opened together are spread over the workers.
+            sessions = await asyncio.gather(*(self._session(port) for _ in range(4)))
+            self.assertEqual(
+                {"worker-1": 2, "worker-2": 2},
+                {name: w.outstanding for name, w in proxy.workers.items()},
+            )
+
+            # Workers left out of the config keep their sessions, as draining,
+            # until the sessions end.
+            self._write_config({"worker-1": workers["worker-1"]})
+            proxy.reload()
+            stats = self._stats()
+            self.assertTrue(stats["worker-2"]["draining"])
+            self.assertEqual(2, stats["worker-2"]["outstanding"])
+            sessions.append(await self._session(port))
+            self.assertEqual(3, proxy.workers["worker-1"].outstanding)
+            self.assertEqual(2, proxy.removed["worker-2"].outstanding)
+
+            for session in sessions:
+                session.close()
+            for _ in range(50):
+                if not proxy.removed:
+                    break
+                await asyncio.sleep(0.01)
+            proxy.write_stats()
+            self.assertEqual(["worker-1"], list(self._stats()))
+            server.close()
+
+        asyncio.run(run())
+
+    def test_worker_refused(self):
+        async def run():
+            with socket.socket() as sock:
+                sock.bind(("127.0.0.1", 0))
+                closed_port = sock.getsockname()[1]
+            echo = await asyncio.start_server(_echo, "127.0.0.1", 0)
+            self._write_config(
+                {"worker-1": closed_port, "worker-2": echo.sockets[0].getsockname()[1]}
+            )
+            proxy = milter_proxy.MilterProxy(self.config_path)
+            server = await asyncio.start_server(proxy.handle, "127.0.0.1", 0)
+            port = server.sockets[0].getsockname()[1]
+
+            session = await self._session(port)
+            self.assertEqual(1, proxy.workers["worker-1"].errors)
+            self.assertEqual(1, proxy.workers["worker-2"].outstanding)
+            session.close()
+
+            # Sessions are closed when no worker is left to take them.
+            self._write_config({"worker-1": closed_port})
+            proxy.reload()
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            self.assertEqual(b"", await reader.read())
+            writer.close()
+            server.close()
+
+        asyncio.run(run())
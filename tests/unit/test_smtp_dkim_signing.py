@@ -3,25 +3,35 @@
 
 """Unit tests for the SMTP DKIM signing charm."""
 
+import gzip
+import hashlib
+import itertools
+import json
 import os
 import shutil
+import subprocess  # nosec B404
 import sys
 import tempfile
+import typing
 import unittest
 from unittest import mock
 
 # We also need to mock up charms.layer so we can run unit tests without having
 # to build the charm and pull in layers such as layer-status.
-sys.modules["charms.layer"] = mock.MagicMock()
+sys.modules.setdefault("charms.layer", mock.MagicMock())
 
 from charmhelpers.core import unitdata  # NOQA: E402
 from charms.layer import status  # NOQA: E402
 
-# Add path to where our reactive layer lives and import.
-sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__)))))
+# Add path to where our reactive layer and libraries live and import.
+CHARM_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+sys.path.append(CHARM_DIR)
+sys.path.append(os.path.join(CHARM_DIR, "lib"))
+import milter_client  # NOQA: E402
+
 from reactive import smtp_dkim_signing  # NOQA: E402
 
-# pylint: disable=unused-argument,protected-access,too-many-public-methods
+# pylint: disable=unused-argument,protected-access,too-many-public-methods,too-many-lines
 
 
 class TestCharm(unittest.TestCase):
@@ -30,6 +40,8 @@ class TestCharm(unittest.TestCase):
         self.tmpdir = tempfile.mkdtemp(prefix="charm-unittests-")
         self.addCleanup(shutil.rmtree, self.tmpdir)
         os.environ["UNIT_STATE_DB"] = os.path.join(self.tmpdir, ".unit-state.db")
+        # Start each test with a fresh unit state DB.
+        unitdata._KV = None
         unitdata.kv().set("test", {})
 
         self.charm_dir = os.path.dirname(
@@ -65,6 +77,8 @@ class TestCharm(unittest.TestCase):
             "selector": "20210622",
         }
 
+        self._patch_juju()
+
         patcher = mock.patch("charmhelpers.core.hookenv.open_port")
         self.mock_open_port = patcher.start()
         self.addCleanup(patcher.stop)
@@ -88,6 +102,62 @@ class TestCharm(unittest.TestCase):
         status.active.reset_mock()
         status.blocked.reset_mock()
         status.maintenance.reset_mock()
+        status.waiting.reset_mock()
+
+    def _patch_juju(self):
+        # Leadership, resources and network bindings the charm looks up.
+        patcher = mock.patch("charmhelpers.core.hookenv.is_leader")
+        self.mock_is_leader = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.mock_is_leader.return_value = True
+
+        patcher = mock.patch("charmhelpers.core.hookenv.leader_get")
+        self.mock_leader_get = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.mock_leader_get.return_value = {}
+
+        patcher = mock.patch("charmhelpers.core.hookenv.leader_set")
+        self.mock_leader_set = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        def leader_set(settings):
+            # Tests replace the leader settings, so look them up on each call.
+            self.mock_leader_get.return_value.update(settings)
+
+        self.mock_leader_set.side_effect = leader_set
+
+        patcher = mock.patch("charmhelpers.core.hookenv.resource_get")
+        self.mock_resource_get = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.mock_resource_get.return_value = False
+
+        patcher = mock.patch("charmhelpers.core.hookenv.network_get")
+        self.mock_network_get = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.mock_network_get.return_value = {"ingress-addresses": ["10.0.0.10"]}
+
+    def _patch_secrets(self):
+        # Keep the secrets the charm stores in a dict rather than Juju.
+        secrets: typing.Dict[str, typing.Dict[str, str]] = {}
+        ids = itertools.count()
+
+        def secret_add(content, description):
+            secret_id = f"secret:{next(ids)}"
+            secrets[secret_id] = dict(content)
+            return secret_id
+
+        def secret_set(secret_id, content):
+            secrets[secret_id] = dict(content)
+
+        for name, side_effect in (
+            ("_secret_add", secret_add),
+            ("_secret_get", lambda secret_id: dict(secrets[secret_id])),
+            ("_secret_set", secret_set),
+        ):
+            patcher = mock.patch(f"reactive.smtp_dkim_signing.{name}", side_effect=side_effect)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        return secrets
 
     @mock.patch("charms.reactive.clear_flag")
     def test_hook_upgrade_charm(self, clear_flag):
@@ -104,8 +174,13 @@ class TestCharm(unittest.TestCase):
 
     @mock.patch("charms.reactive.clear_flag")
     @mock.patch("charms.reactive.set_flag")
-    def test_hook_install(self, set_flag, clear_flag):
+    @mock.patch("charmhelpers.core.host.symlink")
+    def test_hook_install(self, symlink, set_flag, clear_flag):
         smtp_dkim_signing.install()
+        symlink.assert_called_once_with(
+            os.path.join(self.charm_dir, "files", "dkim_archive_check.py"),
+            "/usr/local/bin/dkim-archive-check",
+        )
 
         want = [mock.call("smtp-dkim-signing.installed")]
         set_flag.assert_has_calls(want, any_order=True)
@@ -206,14 +281,210 @@ class TestCharm(unittest.TestCase):
     ):
         opendkim_conf_path = os.path.join(self.tmpdir, "opendkim.conf")
 
+        secrets = self._patch_secrets()
+        self.mock_config.return_value["domains"] = None
         self.mock_config.return_value["signing_key"] = "auto"
-        smtp_dkim_signing.configure_smtp_dkim_signing(opendkim_conf_path)
+        smtp_dkim_signing.configure_smtp_dkim_signing(opendkim_conf_path, self.tmpdir)
+
+        keyfile = os.path.join(self.tmpdir, "20210622.private")
+        with open(keyfile, "r", encoding="utf-8") as f:
+            signing_key = f.read()
+        self.assertIn("PRIVATE KEY-----", signing_key)
+        self.assertEqual(0o600, os.stat(keyfile).st_mode & 0o777)
+        # The key itself goes in a secret, only the secret ID, its revision
+        # and the key fingerprint are published in leader settings.
+        published = self.mock_leader_set.call_args_list[0].args[0]["auto-signing-keys"]
+        self.assertNotIn("PRIVATE KEY", published)
+        self.assertEqual(
+            {
+                "keys": {
+                    "": {
+                        "field": "key-0",
+                        "fingerprint": smtp_dkim_signing._key_fingerprint(signing_key),
+                    }
+                },
+                "revision": 1,
+                "secret": "secret:0",
+                "selector": "20210622",
+            },
+            json.loads(published),
+        )
+        self.assertEqual({"secret:0": {"key-0": signing_key}}, secrets)
+
+        with open(opendkim_conf_path, "r", encoding="utf-8") as f:
+            got = f.read()
+        with open("tests/unit/files/opendkim-domains-none.conf", "r", encoding="utf-8") as f:
+            want = f.read()
+        self.assertEqual(want, got)
+        set_flag.assert_called_with("smtp-dkim-signing.configured")
+
+    @mock.patch("charms.reactive.clear_flag")
+    @mock.patch("charms.reactive.set_flag")
+    @mock.patch("reactive.smtp_dkim_signing._key_fingerprint")
+    @mock.patch("reactive.smtp_dkim_signing._generate_signing_key")
+    def test_configure_smtp_dkim_signing_key_auto_domains(
+        self, generate_signing_key, key_fingerprint, set_flag, clear_flag
+    ):
+        opendkim_conf_path = os.path.join(self.tmpdir, "opendkim.conf")
+
+        secrets = self._patch_secrets()
+        key_fingerprint.side_effect = lambda signing_key: f"SHA256:{signing_key}"
+        generate_signing_key.side_effect = ["key1", "key2"]
+        self.mock_config.return_value["domains"] = "mydomain1.local mydomain2.local"
+        self.mock_config.return_value["signing_key"] = "auto"
+        smtp_dkim_signing.configure_smtp_dkim_signing(opendkim_conf_path, self.tmpdir)
+
+        for domain, want in (("mydomain1.local", "key1"), ("mydomain2.local", "key2")):
+            with open(
+                os.path.join(self.tmpdir, f"{domain}.20210622.private"), "r", encoding="utf-8"
+            ) as f:
+                self.assertEqual(want, f.read())
+        with open(os.path.join(self.tmpdir, "keytable"), "r", encoding="utf-8") as f:
+            got = f.read()
+        want = smtp_dkim_signing.JUJU_HEADER + (
+            "20210622._domainkey.mydomain1.local "
+            "mydomain1.local:20210622:/etc/dkimkeys/mydomain1.local.20210622.private\n"
+            "20210622._domainkey.mydomain2.local "
+            "mydomain2.local:20210622:/etc/dkimkeys/mydomain2.local.20210622.private\n"
+        )
+        self.assertEqual(want, got)
+        with open(os.path.join(self.tmpdir, "signingtable"), "r", encoding="utf-8") as f:
+            got = f.read()
+        want = smtp_dkim_signing.JUJU_HEADER + (
+            "*@mydomain1.local 20210622._domainkey.mydomain1.local\n"
+            "*@mydomain2.local 20210622._domainkey.mydomain2.local\n"
+        )
+        self.assertEqual(want, got)
+
+        # Adding a domain only generates a key for the new one, and all the
+        # keys stay in the one secret.
+        generate_signing_key.side_effect = ["key3"]
+        self.mock_config.return_value["domains"] += " mydomain3.local"
+        smtp_dkim_signing.configure_smtp_dkim_signing(opendkim_conf_path, self.tmpdir)
+        published = json.loads(self.mock_leader_get.return_value["auto-signing-keys"])
+        self.assertEqual(2, published["revision"])
+        self.assertEqual(
+            {"mydomain1.local": "key1", "mydomain2.local": "key2", "mydomain3.local": "key3"},
+            {d: secrets["secret:0"][e["field"]] for d, e in published["keys"].items()},
+        )
+
+        # Changing the selector generates new keys and drops the old ones.
+        generate_signing_key.side_effect = ["key4"]
+        self.mock_config.return_value["domains"] = "mydomain1.local"
+        self.mock_config.return_value["selector"] = "20260101"
+        smtp_dkim_signing.configure_smtp_dkim_signing(opendkim_conf_path, self.tmpdir)
+        self.assertEqual({"secret:0": {"key-0": "key4"}}, secrets)
+
+        # Domains attached as a resource get keys as well, as the tables map them.
+        generate_signing_key.side_effect = ["key5", "key6"]
+        domains_path = os.path.join(self.tmpdir, "domains-resource")
+        with gzip.open(domains_path, "wt", encoding="utf-8") as f:
+            f.write("# Tenants\nmydomain1.local\nmydomain5.local\nmydomain6.local\n")
+        self.mock_resource_get.side_effect = lambda name: (
+            domains_path if name == "domains" else False
+        )
+        smtp_dkim_signing.configure_smtp_dkim_signing(opendkim_conf_path, self.tmpdir)
+        self.assertEqual({"key-0": "key4", "key-1": "key5", "key-2": "key6"}, secrets["secret:0"])
+        with open(
+            os.path.join(self.tmpdir, "mydomain6.local.20260101.private"), "r", encoding="utf-8"
+        ) as f:
+            self.assertEqual("key6", f.read())
+        with open(os.path.join(self.tmpdir, "signingtable"), "r", encoding="utf-8") as f:
+            self.assertIn("*@mydomain6.local 20260101._domainkey.mydomain6.local\n", f.read())
+
+    @mock.patch("charms.reactive.clear_flag")
+    @mock.patch("charms.reactive.set_flag")
+    def test_configure_smtp_dkim_signing_key_auto_follower(self, set_flag, clear_flag):
+        opendkim_conf_path = os.path.join(self.tmpdir, "opendkim.conf")
+
+        self.mock_is_leader.return_value = False
+        self.mock_config.return_value["domains"] = None
+        self.mock_config.return_value["signing_key"] = "auto"
+        smtp_dkim_signing.configure_smtp_dkim_signing(opendkim_conf_path, self.tmpdir)
+        status.waiting.assert_called_with("Waiting for leader to generate signing keys")
+        set_flag.assert_not_called()
+        self.mock_leader_set.assert_not_called()
+
+        # Keys for another selector are not used either.
+        secrets = self._patch_secrets()
+        self.mock_leader_get.return_value = {
+            "auto-signing-keys": json.dumps(
+                {
+                    "keys": {"": {"field": "key-0", "fingerprint": ""}},
+                    "revision": 1,
+                    "secret": "secret:9",
+                    "selector": "2019",
+                }
+            )
+        }
+        smtp_dkim_signing.configure_smtp_dkim_signing(opendkim_conf_path, self.tmpdir)
+        set_flag.assert_not_called()
 
+        self.mock_is_leader.return_value = True
+        smtp_dkim_signing.configure_smtp_dkim_signing(opendkim_conf_path, self.tmpdir)
+        self.mock_is_leader.return_value = False
+        self.mock_leader_get.return_value = {
+            k: v for c in self.mock_leader_set.call_args_list for k, v in c.args[0].items()
+        }
+        os.remove(os.path.join(self.tmpdir, "20210622.private"))
+        set_flag.reset_mock()
+        smtp_dkim_signing.configure_smtp_dkim_signing(opendkim_conf_path, self.tmpdir)
+        self.assertTrue(os.path.exists(os.path.join(self.tmpdir, "20210622.private")))
+        set_flag.assert_called_with("smtp-dkim-signing.configured")
+
+        # Keys are not fetched again until the secret has a new revision.
+        with mock.patch("reactive.smtp_dkim_signing._secret_get") as secret_get:
+            smtp_dkim_signing.configure_smtp_dkim_signing(opendkim_conf_path, self.tmpdir)
+            secret_get.assert_not_called()
+
+        # Keys not matching their published fingerprint are not used.
+        with open("tests/unit/files/rotation_key.private", "r", encoding="utf-8") as f:
+            secrets["secret:9"]["key-0"] = f.read()
+        published = json.loads(self.mock_leader_get.return_value["auto-signing-keys"])
+        self.mock_leader_get.return_value["auto-signing-keys"] = json.dumps(
+            dict(published, revision=published["revision"] + 1)
+        )
+        set_flag.reset_mock()
+        smtp_dkim_signing.configure_smtp_dkim_signing(opendkim_conf_path, self.tmpdir)
         status.blocked.assert_called_with(
-            "Automatic generation of signing keys not implemented yet"
+            "Signing key in secret secret:9 does not match its fingerprint"
         )
-        self.mock_service_reload.assert_not_called()
-        self.mock_open_port.assert_not_called()
+        set_flag.assert_not_called()
+
+    @mock.patch("subprocess.check_call")
+    @mock.patch("subprocess.check_output")
+    def test__secret_add(self, check_output, check_call):
+        passed = {}
+
+        def read_content(args, **kwargs):
+            # Content is passed in files only the charm can read, never on the
+            # command line.
+            for arg in args:
+                key, _, path = arg.partition("#file=")
+                if not path:
+                    continue
+                self.assertEqual(0o600, os.stat(path).st_mode & 0o777)
+                with open(path, "r", encoding="utf-8") as f:
+                    passed[key] = f.read()
+            return "secret:1\n"
+
+        check_output.side_effect = read_content
+        check_call.side_effect = read_content
+        self.assertEqual(
+            "secret:1",
+            smtp_dkim_signing._secret_add({"key-0": "PRIVATE KEY"}, "DKIM signing keys"),
+        )
+        self.assertEqual(
+            ["secret-add", "--description", "DKIM signing keys"],
+            check_output.call_args.args[0][:3],
+        )
+        self.assertEqual({"key-0": "PRIVATE KEY"}, passed)
+        self.assertNotIn("PRIVATE KEY", " ".join(check_output.call_args.args[0]))
+
+        smtp_dkim_signing._secret_set("secret:1", {"key-1": "OTHER KEY"})
+        self.assertEqual(["secret-set", "secret:1"], check_call.call_args.args[0][:2])
+        self.assertEqual("OTHER KEY", passed["key-1"])
+        self.assertFalse(os.path.exists(check_call.call_args.args[0][2].partition("#file=")[2]))
 
     @mock.patch("charms.reactive.clear_flag")
     @mock.patch("charms.reactive.set_flag")
@@ -402,6 +673,1147 @@ class TestCharm(unittest.TestCase):
         self.mock_service_reload.assert_called()
         self.mock_open_port.assert_called_with(smtp_dkim_signing.OPENDKIM_MILTER_PORT, "TCP")
 
+    @mock.patch("charms.reactive.clear_flag")
+    @mock.patch("charms.reactive.set_flag")
+    def test_configure_smtp_dkim_signing_leader_tables(self, set_flag, clear_flag):
+        opendkim_conf_path = os.path.join(self.tmpdir, "opendkim.conf")
+
+        with open("tests/unit/files/keytable", "r", encoding="utf-8") as f:
+            keytable = f.read()
+        self.mock_config.return_value["keytable"] = keytable
+        smtp_dkim_signing.configure_smtp_dkim_signing(opendkim_conf_path, self.tmpdir)
+
+        # Only the hashes are published, the tables themselves can be too
+        # large for leader settings.
+        published = self.mock_leader_set.call_args.args[0]
+        hashes = json.loads(published["tables-hashes"])
+        self.assertEqual(
+            hashlib.sha256(
+                (smtp_dkim_signing.JUJU_HEADER + keytable + "\n").encode("utf-8")
+            ).hexdigest(),
+            hashes["keytable"],
+        )
+        self.assertEqual(hashlib.sha256(b"myawsomedomain.local").hexdigest(), hashes["domains"])
+
+    @mock.patch("charms.reactive.clear_flag")
+    @mock.patch("charms.reactive.set_flag")
+    @mock.patch("reactive.smtp_dkim_signing._write_file", wraps=smtp_dkim_signing._write_file)
+    def test_configure_smtp_dkim_signing_follower_tables(self, write_file, set_flag, clear_flag):
+        opendkim_conf_path = os.path.join(self.tmpdir, "opendkim.conf")
+        keytable_path = os.path.join(self.tmpdir, "keytable")
+
+        with open("tests/unit/files/keytable", "r", encoding="utf-8") as f:
+            self.mock_config.return_value["keytable"] = f.read()
+        smtp_dkim_signing.configure_smtp_dkim_signing(opendkim_conf_path, self.tmpdir)
+        published = dict(self.mock_leader_get.return_value)
+
+        with open(keytable_path, "r", encoding="utf-8") as f:
+            keytable = f.read()
+
+        # Leader has not caught up with the config change yet, so the tables
+        # compiled from it are not made live.
+        self.mock_is_leader.return_value = False
+        set_flag.reset_mock()
+        self.mock_leader_set.reset_mock()
+        self.mock_config.return_value["domains"] = "mydomain.local"
+        self.mock_config.return_value["keytable"] = "mydomain.local mydomain.local:sel:/k"
+        smtp_dkim_signing.configure_smtp_dkim_signing(opendkim_conf_path, self.tmpdir)
+        status.waiting.assert_called_with("Waiting for leader to publish compiled tables")
+        set_flag.assert_not_called()
+        with open(keytable_path, "r", encoding="utf-8") as f:
+            self.assertEqual(keytable, f.read())
+        self.assertFalse(
+            os.path.exists(os.path.join(self.tmpdir, smtp_dkim_signing.TABLES_STAGING_DIR))
+        )
+
+        # Tables compiled differently from the leader's are not used.
+        self.mock_config.return_value["domains"] = "myawsomedomain.local"
+        with open("tests/unit/files/keytable", "r", encoding="utf-8") as f:
+            self.mock_config.return_value["keytable"] = f.read()
+        hashes = json.loads(published["tables-hashes"])
+        self.mock_leader_get.return_value = dict(
+            published, **{"tables-hashes": json.dumps(dict(hashes, keytable="0" * 64))}
+        )
+        smtp_dkim_signing.configure_smtp_dkim_signing(opendkim_conf_path, self.tmpdir)
+        status.waiting.assert_called_with(
+            "Waiting for tables to match the ones compiled by the leader"
+        )
+        set_flag.assert_not_called()
+
+        # Followers compile their own tables matching the leader's, and leave
+        # the ones already live alone.
+        inode = os.stat(keytable_path).st_ino
+        write_file.reset_mock()
+        self.mock_leader_get.return_value = published
+        smtp_dkim_signing.configure_smtp_dkim_signing(opendkim_conf_path, self.tmpdir)
+        self.assertNotIn(keytable_path, [c.args[1] for c in write_file.mock_calls])
+        self.assertEqual(inode, os.stat(keytable_path).st_ino)
+        self.mock_leader_set.assert_not_called()
+        set_flag.assert_called_with("smtp-dkim-signing.configured")
+
+    @mock.patch("charms.reactive.clear_flag")
+    def test_hook_leader_settings_changed(self, clear_flag):
+        smtp_dkim_signing.leader_settings_changed()
+        clear_flag.assert_called_once_with("smtp-dkim-signing.configured")
+
+    @mock.patch("charms.reactive.clear_flag")
+    @mock.patch("charms.reactive.set_flag")
+    def test_configure_smtp_dkim_signing_table_resources(self, set_flag, clear_flag):
+        opendkim_conf_path = os.path.join(self.tmpdir, "opendkim.conf")
+        resources_dir = os.path.join(self.tmpdir, "resources")
+        os.mkdir(resources_dir)
+
+        domains = [f"tenant{i}.local" for i in range(10000)]
+        with gzip.open(os.path.join(resources_dir, "keytable"), "wt", encoding="utf-8") as f:
+            for domain in domains:
+                f.write(f"mail._domainkey.{domain} {domain}:mail:/etc/dkimkeys/{domain}.private\n")
+        with open(os.path.join(resources_dir, "domains"), "w", encoding="utf-8") as f:
+            f.write("# Tenants\n" + "\n".join(domains) + "\n")
+        # Not attached.
+        with open(os.path.join(resources_dir, "signingtable"), "w", encoding="utf-8"):
+            pass
+        self.mock_resource_get.side_effect = lambda name: os.path.join(resources_dir, name)
+        with open("tests/unit/files/signingtable", "r", encoding="utf-8") as f:
+            signingtable = f.read()
+        self.mock_config.return_value["keytable"] = "ignored"
+        self.mock_config.return_value["signingtable"] = signingtable
+
+        smtp_dkim_signing.configure_smtp_dkim_signing(opendkim_conf_path, self.tmpdir)
+        with open(opendkim_conf_path, "r", encoding="utf-8") as f:
+            got = f.read()
+        self.assertIn(f"Domain {os.path.join(self.tmpdir, 'domains')}\n", got)
+        self.assertIn(f"KeyTable file:{os.path.join(self.tmpdir, 'keytable')}\n", got)
+        self.assertIn(f"SigningTable refile:{os.path.join(self.tmpdir, 'signingtable')}\n", got)
+        with open(os.path.join(self.tmpdir, "keytable"), "r", encoding="utf-8") as f:
+            got = f.read()
+        self.assertTrue(got.startswith(smtp_dkim_signing.JUJU_HEADER + "mail._domainkey.tenant0"))
+        self.assertEqual(len(domains) + 2, len(got.splitlines()))
+        with open(os.path.join(self.tmpdir, "signingtable"), "r", encoding="utf-8") as f:
+            self.assertEqual(smtp_dkim_signing.JUJU_HEADER + signingtable + "\n", f.read())
+        set_flag.assert_called_with("smtp-dkim-signing.configured")
+
+        # Unchanged resources are not written out again, nor is opendkim reloaded.
+        self.mock_service_reload.reset_mock()
+        mtime = os.stat(os.path.join(self.tmpdir, "keytable")).st_mtime_ns
+        smtp_dkim_signing.configure_smtp_dkim_signing(opendkim_conf_path, self.tmpdir)
+        self.assertEqual(mtime, os.stat(os.path.join(self.tmpdir, "keytable")).st_mtime_ns)
+        self.mock_service_reload.assert_not_called()
+
+        # Table changes alone are picked up with a reload.
+        with open(os.path.join(resources_dir, "domains"), "a", encoding="utf-8") as f:
+            f.write("newtenant.local\n")
+        smtp_dkim_signing.configure_smtp_dkim_signing(opendkim_conf_path, self.tmpdir)
+        self.mock_service_reload.assert_called_once_with("opendkim")
+
+    @mock.patch("charms.reactive.clear_flag")
+    @mock.patch("charms.reactive.set_flag")
+    def test_configure_smtp_dkim_signing_multiple_signatures(self, set_flag, clear_flag):
+        opendkim_conf_path = os.path.join(self.tmpdir, "opendkim.conf")
+        signingtable_path = os.path.join(self.tmpdir, "signingtable")
+        self.mock_config.return_value.update(
+            {
+                "multiple_signatures": True,
+                "signingtable": "# Tenant\n*@tenant.local tenant,platform\n*@other.local other",
+            }
+        )
+        smtp_dkim_signing.configure_smtp_dkim_signing(opendkim_conf_path, self.tmpdir)
+        with open(opendkim_conf_path, "r", encoding="utf-8") as f:
+            got = f.read()
+        self.assertIn(
+            f"SignHeaders {smtp_dkim_signing.DEFAULT_SIGN_HEADERS}\nMultipleSignatures yes\n", got
+        )
+        with open(signingtable_path, "r", encoding="utf-8") as f:
+            got = f.read()
+        want = (
+            smtp_dkim_signing.JUJU_HEADER
+            + "# Tenant\n*@tenant.local tenant\n*@tenant.local platform\n*@other.local other\n"
+        )
+        self.assertEqual(want, got)
+
+        # Same for the signingtable resource.
+        resource_path = os.path.join(self.tmpdir, "resource")
+        with open(resource_path, "w", encoding="utf-8") as f:
+            f.write("*@tenant.local  tenant,platform,\n")
+        self.mock_resource_get.side_effect = lambda name: (
+            resource_path if name == "signingtable" else False
+        )
+        smtp_dkim_signing.configure_smtp_dkim_signing(opendkim_conf_path, self.tmpdir)
+        with open(signingtable_path, "r", encoding="utf-8") as f:
+            got = f.read()
+        want = smtp_dkim_signing.JUJU_HEADER + "*@tenant.local tenant\n*@tenant.local platform\n"
+        self.assertEqual(want, got)
+
+        self.mock_config.return_value["multiple_signatures"] = False
+        smtp_dkim_signing.configure_smtp_dkim_signing(opendkim_conf_path, self.tmpdir)
+        with open(opendkim_conf_path, "r", encoding="utf-8") as f:
+            self.assertNotIn("MultipleSignatures", f.read())
+
+    @mock.patch("charms.reactive.clear_flag")
+    @mock.patch("charms.reactive.set_flag")
+    def test_configure_smtp_dkim_signing_table_resource_invalid(self, set_flag, clear_flag):
+        opendkim_conf_path = os.path.join(self.tmpdir, "opendkim.conf")
+        resource_path = os.path.join(self.tmpdir, "resource")
+        with open(resource_path, "w", encoding="utf-8") as f:
+            f.write("mydomain1.local\n\nmydomain2.local some-garbage\n")
+        self.mock_resource_get.side_effect = lambda name: (
+            resource_path if name == "domains" else False
+        )
+
+        smtp_dkim_signing.configure_smtp_dkim_signing(opendkim_conf_path, self.tmpdir)
+        status.blocked.assert_called_with("Invalid domains resource on line 3")
+        self.assertFalse(os.path.exists(os.path.join(self.tmpdir, "domains")))
+        self.assertFalse(os.path.exists(os.path.join(self.tmpdir, "domains.new")))
+        set_flag.assert_not_called()
+
+    @mock.patch("charms.reactive.clear_flag")
+    @mock.patch("charms.reactive.set_flag")
+    @mock.patch("charmhelpers.core.hookenv.relation_ids")
+    def test_configure_smtp_dkim_signing_default_action(self, relation_ids, set_flag, clear_flag):
+        opendkim_conf_path = os.path.join(self.tmpdir, "opendkim.conf")
+
+        self.mock_config.return_value["milter_default_action"] = "accept"
+        smtp_dkim_signing.configure_smtp_dkim_signing(opendkim_conf_path, self.tmpdir)
+        with open(opendkim_conf_path, "r", encoding="utf-8") as f:
+            got = f.read()
+        self.assertIn("On-InternalError accept\nOn-SignatureError accept\n", got)
+
+        status.blocked.reset_mock()
+        self.mock_config.return_value["milter_default_action"] = "reject"
+        smtp_dkim_signing.configure_smtp_dkim_signing(opendkim_conf_path, self.tmpdir)
+        status.blocked.assert_called_with("Invalid milter_default_action provided")
+
+    @mock.patch("charms.reactive.clear_flag")
+    @mock.patch("charms.reactive.set_flag")
+    @mock.patch("charmhelpers.core.hookenv.relation_ids")
+    def test_configure_smtp_dkim_signing_resource_limits(self, relation_ids, set_flag, clear_flag):
+        opendkim_conf_path = os.path.join(self.tmpdir, "opendkim.conf")
+
+        self.mock_config.return_value.update(
+            {
+                "maximum_headers": 32768,
+                "maximum_signatures_to_verify": 2,
+                "maximum_signed_bytes": 0,
+                "minimum_key_bits": 2048,
+            }
+        )
+        smtp_dkim_signing.configure_smtp_dkim_signing(opendkim_conf_path, self.tmpdir)
+        with open(opendkim_conf_path, "r", encoding="utf-8") as f:
+            got = f.read()
+        self.assertIn(
+            "On-SignatureError tempfail\nMaximumHeaders 32768\n"
+            "MaximumSignaturesToVerify 2\nMinimumKeyBits 2048\n",
+            got,
+        )
+        self.assertNotIn("MaximumSignedBytes", got)
+
+        for option, value in (
+            ("maximum_headers", 100),
+            ("maximum_signatures_to_verify", -1),
+            ("minimum_key_bits", 512),
+        ):
+            status.blocked.reset_mock()
+            self.mock_config.return_value[option] = value
+            smtp_dkim_signing.configure_smtp_dkim_signing(opendkim_conf_path, self.tmpdir)
+            status.blocked.assert_called_with(f"Invalid {option} provided")
+            self.mock_config.return_value[option] = 0
+
+    @mock.patch("charms.reactive.clear_flag")
+    @mock.patch("charms.reactive.set_flag")
+    @mock.patch("charmhelpers.core.hookenv.relation_ids")
+    def test_configure_smtp_dkim_signing_rotation_staged(self, relation_ids, set_flag, clear_flag):
+        opendkim_conf_path = os.path.join(self.tmpdir, "opendkim.conf")
+
+        with open("tests/unit/files/signing_key.private", "r", encoding="utf-8") as f:
+            signing_key = f.read()
+        with open("tests/unit/files/rotation_key.private", "r", encoding="utf-8") as f:
+            rotation_key = f.read()
+        self.mock_config.return_value["signing_key"] = signing_key
+        self.mock_config.return_value["rotation_selector"] = "20250101"
+        self.mock_config.return_value["rotation_signing_key"] = rotation_key
+        smtp_dkim_signing.configure_smtp_dkim_signing(opendkim_conf_path, self.tmpdir)
+
+        # Staged key is written out, but signing still uses the active one.
+        with open(os.path.join(self.tmpdir, "20250101.private"), "r", encoding="utf-8") as f:
+            self.assertEqual(rotation_key, f.read())
+        with open(opendkim_conf_path, "r", encoding="utf-8") as f:
+            got = f.read()
+        with open("tests/unit/files/opendkim.conf", "r", encoding="utf-8") as f:
+            want = f.read()
+        self.assertEqual(want, got)
+
+    @mock.patch("charms.reactive.clear_flag")
+    @mock.patch("charms.reactive.set_flag")
+    @mock.patch("charmhelpers.core.hookenv.relation_ids")
+    def test_configure_smtp_dkim_signing_rotation_key_invalid(
+        self, relation_ids, set_flag, clear_flag
+    ):
+        opendkim_conf_path = os.path.join(self.tmpdir, "opendkim.conf")
+
+        self.mock_config.return_value["rotation_selector"] = "20250101"
+        self.mock_config.return_value["rotation_signing_key"] = "someinvalidkey"
+        smtp_dkim_signing.configure_smtp_dkim_signing(opendkim_conf_path, self.tmpdir)
+
+        self.assertFalse(os.path.exists(os.path.join(self.tmpdir, "20250101.private")))
+        status.blocked.assert_called_with("Invalid rotation signing key provided")
+        self.mock_service_reload.assert_not_called()
+
+    @mock.patch("charms.reactive.clear_flag")
+    @mock.patch("charms.reactive.set_flag")
+    @mock.patch("charmhelpers.core.hookenv.relation_ids")
+    def test_rotate_signing_key(self, relation_ids, set_flag, clear_flag):
+        opendkim_conf_path = os.path.join(self.tmpdir, "opendkim.conf")
+
+        with open("tests/unit/files/rotation_key.private", "r", encoding="utf-8") as f:
+            rotation_key = f.read()
+        self.mock_config.return_value["rotation_selector"] = "20250101"
+        self.mock_config.return_value["rotation_signing_key"] = rotation_key
+        smtp_dkim_signing.configure_smtp_dkim_signing(opendkim_conf_path, self.tmpdir)
+        self.mock_service_reload.reset_mock()
+
+        selectors = smtp_dkim_signing.rotate_signing_key(self.tmpdir)
+        self.assertEqual({"previous": "20210622", "selector": "20250101"}, selectors)
+        clear_flag.assert_called_with("smtp-dkim-signing.configured")
+
+        smtp_dkim_signing.configure_smtp_dkim_signing(opendkim_conf_path, self.tmpdir)
+        with open(opendkim_conf_path, "r", encoding="utf-8") as f:
+            got = f.read()
+        self.assertIn("KeyFile /etc/dkimkeys/20250101.private\nSelector 20250101\n", got)
+        self.mock_service_reload.assert_called()
+
+        # Rotating again to the same selector is refused.
+        with self.assertRaises(ValueError):
+            smtp_dkim_signing.rotate_signing_key(self.tmpdir)
+
+        # Staging the next rotation before finalizing keeps signing with the
+        # rotated to key, and blocks until finalized.
+        self.mock_config.return_value["rotation_selector"] = "20260101"
+        smtp_dkim_signing.configure_smtp_dkim_signing(opendkim_conf_path, self.tmpdir)
+        status.blocked.assert_called_with(
+            "Set selector and signing_key to the rotated to key 20250101"
+            " before staging another rotation"
+        )
+        self.assertEqual(
+            "20250101", smtp_dkim_signing._active_selector(self.mock_config.return_value)
+        )
+        with self.assertRaises(ValueError):
+            smtp_dkim_signing.rotate_signing_key(self.tmpdir)
+
+        # Finalizing the rotation hands the selector back to config.
+        self.mock_config.return_value["selector"] = "20250101"
+        self.mock_config.return_value["signing_key"] = rotation_key
+        del self.mock_config.return_value["rotation_selector"]
+        smtp_dkim_signing.configure_smtp_dkim_signing(opendkim_conf_path, self.tmpdir)
+        rotation = json.loads(
+            self.mock_leader_get.return_value[smtp_dkim_signing.ROTATION_STATE_KEY]
+        )
+        self.assertTrue(rotation["finalized"])
+        self.mock_config.return_value["selector"] = "20260101"
+        self.assertEqual(
+            "20260101", smtp_dkim_signing._active_selector(self.mock_config.return_value)
+        )
+
+    def test_rotate_signing_key_not_staged(self):
+        with self.assertRaises(ValueError):
+            smtp_dkim_signing.rotate_signing_key(self.tmpdir)
+
+        # Selector configured, but no key written out for it.
+        self.mock_config.return_value["rotation_selector"] = "20250101"
+        with self.assertRaises(ValueError):
+            smtp_dkim_signing.rotate_signing_key(self.tmpdir)
+
+    def test_rotate_signing_key_refused(self):
+        shutil.copy(
+            "tests/unit/files/rotation_key.private", os.path.join(self.tmpdir, "20250101.private")
+        )
+        self.mock_config.return_value["rotation_selector"] = "20250101"
+
+        # Only the leader rotates, the rotation is shared by all units.
+        self.mock_is_leader.return_value = False
+        with self.assertRaises(ValueError):
+            smtp_dkim_signing.rotate_signing_key(self.tmpdir)
+
+        # Keys selected by tables are not rotated.
+        self.mock_is_leader.return_value = True
+        self.mock_config.return_value["signingtable"] = "*@mydomain.local mydomain.local"
+        with self.assertRaises(ValueError):
+            smtp_dkim_signing.rotate_signing_key(self.tmpdir)
+        self.mock_leader_set.assert_not_called()
+
+    @mock.patch("charms.reactive.clear_flag")
+    @mock.patch("time.time")
+    def test_retire_rotated_key(self, time_time, clear_flag):
+        old_keyfile = os.path.join(self.tmpdir, "20210622.private")
+        shutil.copy("tests/unit/files/signing_key.private", old_keyfile)
+        shutil.copy(
+            "tests/unit/files/rotation_key.private", os.path.join(self.tmpdir, "20250101.private")
+        )
+        self.mock_config.return_value["rotation_selector"] = "20250101"
+        self.mock_config.return_value["rotation_grace_period"] = 72
+        time_time.return_value = 1000.0
+        smtp_dkim_signing.rotate_signing_key(self.tmpdir)
+
+        # Still within the grace period.
+        time_time.return_value = 1000.0 + 71 * 3600
+        smtp_dkim_signing.retire_rotated_key(self.tmpdir)
+        self.assertTrue(os.path.exists(old_keyfile))
+
+        time_time.return_value = 1000.0 + 72 * 3600
+        smtp_dkim_signing.retire_rotated_key(self.tmpdir)
+        self.assertFalse(os.path.exists(old_keyfile))
+
+        # Retired keys are not written out again from config.
+        with open("tests/unit/files/signing_key.private", "r", encoding="utf-8") as f:
+            self.mock_config.return_value["signing_key"] = f.read()
+        self.assertTrue(
+            smtp_dkim_signing._write_signing_keys(self.mock_config.return_value, self.tmpdir, True)
+        )
+        self.assertFalse(os.path.exists(old_keyfile))
+
+    @mock.patch("charms.reactive.clear_flag")
+    def test_dkim_dns_records(self, clear_flag):
+        shutil.copy(
+            "tests/unit/files/rotation_key.private", os.path.join(self.tmpdir, "20210622.private")
+        )
+        shutil.copy(
+            "tests/unit/files/rotation_key.private", os.path.join(self.tmpdir, "20250101.private")
+        )
+        self.mock_config.return_value["domains"] = "mydomain1.local,mydomain2.local"
+        self.mock_config.return_value["rotation_selector"] = "20250101"
+        self.mock_config.return_value["rotation_grace_period"] = 72
+
+        got = smtp_dkim_signing.dkim_dns_records(self.tmpdir)
+        self.assertEqual(["active", "staged"], sorted(got))
+        self.assertEqual(2, len(got["active"]))
+        self.assertTrue(
+            got["active"][0].startswith(
+                '20210622._domainkey.mydomain1.local. IN TXT "v=DKIM1; k=rsa; p=MIIBIjAN'
+            )
+        )
+        self.assertTrue(got["staged"][1].startswith("20250101._domainkey.mydomain2.local. "))
+        # Public key is split over multiple TXT character-strings.
+        self.assertEqual(1, got["active"][0].count('" "'))
+
+        smtp_dkim_signing.rotate_signing_key(self.tmpdir)
+        got = smtp_dkim_signing.dkim_dns_records(self.tmpdir)
+        self.assertEqual(["active", "retiring"], sorted(got))
+        self.assertTrue(got["active"][0].startswith("20250101._domainkey.mydomain1.local. "))
+
+    @mock.patch("charms.reactive.clear_flag")
+    @mock.patch("charms.reactive.set_flag")
+    @mock.patch("charmhelpers.core.hookenv.relation_ids")
+    @mock.patch("charmhelpers.core.host.service_restart")
+    @mock.patch("subprocess.call")
+    def test_configure_smtp_dkim_signing_systemd_dropin(
+        self, call, service_restart, relation_ids, set_flag, clear_flag
+    ):
+        opendkim_conf_path = os.path.join(self.tmpdir, "opendkim.conf")
+        dropin_path = os.path.join(self.tmpdir, "opendkim.service.d", "juju.conf")
+
+        self.mock_config.return_value.update(
+            {
+                "service_cpu_affinity": "0-3 6",
+                "service_cpu_quota": "200%",
+                "service_limit_nofile": "65536",
+                "service_memory_max": "512M",
+                "service_nice": -5,
+                "service_restart": "on-failure",
+            }
+        )
+        smtp_dkim_signing.configure_smtp_dkim_signing(opendkim_conf_path, self.tmpdir, dropin_path)
+        with open(dropin_path, "r", encoding="utf-8") as f:
+            got = f.read()
+        with open("tests/unit/files/opendkim-systemd-dropin.conf", "r", encoding="utf-8") as f:
+            want = f.read()
+        self.assertEqual(want, got)
+        call.assert_called_once_with(["systemctl", "daemon-reload"])
+        service_restart.assert_called_once_with("opendkim")
+        # Restart already picks up the new opendkim.conf.
+        self.mock_service_reload.assert_not_called()
+
+        # No changes, so no daemon-reload nor restart.
+        call.reset_mock()
+        service_restart.reset_mock()
+        smtp_dkim_signing.configure_smtp_dkim_signing(opendkim_conf_path, self.tmpdir, dropin_path)
+        call.assert_not_called()
+        service_restart.assert_not_called()
+
+        # Drop-in removed when all the options are unset.
+        for option in smtp_dkim_signing.SERVICE_CONFIG_PATTERNS:
+            self.mock_config.return_value[option] = ""
+        self.mock_config.return_value["service_nice"] = 0
+        smtp_dkim_signing.configure_smtp_dkim_signing(opendkim_conf_path, self.tmpdir, dropin_path)
+        self.assertFalse(os.path.exists(dropin_path))
+        call.assert_called_once_with(["systemctl", "daemon-reload"])
+        service_restart.assert_called_once_with("opendkim")
+
+    @mock.patch("charms.reactive.clear_flag")
+    @mock.patch("charms.reactive.set_flag")
+    @mock.patch("subprocess.call")
+    def test_configure_smtp_dkim_signing_systemd_dropin_invalid(self, call, set_flag, clear_flag):
+        opendkim_conf_path = os.path.join(self.tmpdir, "opendkim.conf")
+        dropin_path = os.path.join(self.tmpdir, "opendkim.service.d", "juju.conf")
+
+        self.mock_config.return_value["service_cpu_quota"] = "2 cpus"
+        self.mock_config.return_value["service_restart"] = "sometimes"
+        self.mock_config.return_value["service_nice"] = 20
+        smtp_dkim_signing.configure_smtp_dkim_signing(opendkim_conf_path, self.tmpdir, dropin_path)
+        status.blocked.assert_called_with(
+            "Invalid service_cpu_quota, service_restart, service_nice provided"
+        )
+        self.assertFalse(os.path.exists(dropin_path))
+        call.assert_not_called()
+        set_flag.assert_not_called()
+
+    @mock.patch("charms.reactive.clear_flag")
+    @mock.patch("charms.reactive.set_flag")
+    @mock.patch("charmhelpers.core.hookenv.relation_ids")
+    @mock.patch("charmhelpers.core.hookenv.remote_service_name")
+    @mock.patch("charmhelpers.core.hookenv.close_port")
+    @mock.patch("charmhelpers.core.host.service_pause")
+    @mock.patch("charmhelpers.core.host.service_resume")
+    @mock.patch("subprocess.call")
+    def test_configure_smtp_dkim_signing_milter_isolation(
+        self,
+        call,
+        service_resume,
+        service_pause,
+        close_port,
+        remote_service_name,
+        relation_ids,
+        set_flag,
+        clear_flag,
+    ):  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        opendkim_conf_path = os.path.join(self.tmpdir, "opendkim.conf")
+        instances_dir = os.path.join(self.tmpdir, "opendkim.d")
+        dropin_path = os.path.join(self.tmpdir, "system", "opendkim.service.d", "juju.conf")
+        relation_ids.side_effect = lambda endpoint: {"milter": ["milter:3", "milter:7"]}.get(
+            endpoint, []
+        )
+        remote_service_name.side_effect = {
+            "milter:3": "newsletter-relay",
+            "milter:7": "transactional-relay",
+        }.get
+        self.mock_config.return_value.update(
+            {
+                "milter_isolation": True,
+                "milter_isolation_domains": "# Bulk\nnewsletter-relay news.example.com",
+                "service_memory_max": "512M",
+                "signingtable": "*@news.example.com news\n*@example.com transactional",
+            }
+        )
+        smtp_dkim_signing.configure_smtp_dkim_signing(opendkim_conf_path, self.tmpdir, dropin_path)
+
+        with open(os.path.join(instances_dir, "milter-3.conf"), "r", encoding="utf-8") as f:
+            got = f.read()
+        self.assertIn("Socket inet:9000\n", got)
+        self.assertIn("PidFile /run/opendkim/milter-3.pid\n", got)
+        self.assertIn("Domain news.example.com\n", got)
+        signingtable = os.path.join(instances_dir, "milter-3.signingtable")
+        self.assertIn(f"SigningTable refile:{signingtable}\n", got)
+        with open(signingtable, "r", encoding="utf-8") as f:
+            self.assertEqual(smtp_dkim_signing.JUJU_HEADER + "*@news.example.com news\n", f.read())
+        with open(os.path.join(instances_dir, "milter-7.conf"), "r", encoding="utf-8") as f:
+            got = f.read()
+        self.assertIn("Socket inet:9001\n", got)
+        self.assertIn("Domain myawsomedomain.local\n", got)
+        self.assertIn(f"SigningTable refile:{self.tmpdir}/signingtable\n", got)
+        self.assertFalse(os.path.exists(os.path.join(instances_dir, "milter-7.signingtable")))
+
+        with open(
+            os.path.join(self.tmpdir, "system", "opendkim@.service"), "r", encoding="utf-8"
+        ) as f:
+            self.assertIn(f"ExecStart=/usr/sbin/opendkim -x {instances_dir}/%i.conf\n", f.read())
+        # Each instance gets the same resource limits as the main service.
+        with open(
+            os.path.join(self.tmpdir, "system", "opendkim@.service.d", "juju.conf"),
+            "r",
+            encoding="utf-8",
+        ) as f:
+            self.assertIn("MemoryMax=512M", f.read())
+        call.assert_called_with(["systemctl", "daemon-reload"])
+        service_resume.assert_has_calls(
+            [mock.call("opendkim@milter-3"), mock.call("opendkim@milter-7")]
+        )
+        self.mock_open_port.assert_has_calls(
+            [mock.call(9000, "TCP"), mock.call(9001, "TCP")], any_order=True
+        )
+
+        # Instance of the relation gone is removed, the others keep their port.
+        relation_ids.side_effect = lambda endpoint: {"milter": ["milter:7"]}.get(endpoint, [])
+        smtp_dkim_signing.configure_smtp_dkim_signing(opendkim_conf_path, self.tmpdir, dropin_path)
+        service_pause.assert_called_once_with("opendkim@milter-3")
+        close_port.assert_called_once_with(9000, "TCP")
+        self.assertEqual(["milter-7.conf"], os.listdir(instances_dir))
+        self.assertEqual({"milter:7": 9001}, smtp_dkim_signing._instance_ports())
+
+        # And all of them when disabled.
+        self.mock_config.return_value["milter_isolation"] = False
+        smtp_dkim_signing.configure_smtp_dkim_signing(opendkim_conf_path, self.tmpdir, dropin_path)
+        service_pause.assert_called_with("opendkim@milter-7")
+        self.assertEqual([], os.listdir(instances_dir))
+
+    @mock.patch("charms.reactive.clear_flag")
+    @mock.patch("charms.reactive.set_flag")
+    @mock.patch("charmhelpers.core.hookenv.relation_ids")
+    def test__allocate_instance_ports(self, relation_ids, set_flag, clear_flag):
+        self.mock_config.return_value["milter_isolation"] = True
+        rids = ["milter:250000", "milter:3"]
+        relation_ids.side_effect = lambda endpoint: {"milter": rids}.get(endpoint, [])
+
+        # Ports come from the fixed range, whatever the relation id.
+        self.assertTrue(smtp_dkim_signing._allocate_instance_ports(self.mock_config.return_value))
+        self.assertEqual(
+            {"milter:250000": 9000, "milter:3": 9001}, smtp_dkim_signing._instance_ports()
+        )
+
+        # Followers wait for the leader to allocate ports to new relations.
+        self.mock_is_leader.return_value = False
+        rids.append("milter:4")
+        self.assertFalse(smtp_dkim_signing._allocate_instance_ports(self.mock_config.return_value))
+
+        # The unit is blocked once the range is exhausted.
+        self.mock_is_leader.return_value = True
+        rids.extend(f"milter:{n}" for n in range(100, 200))
+        smtp_dkim_signing.configure_smtp_dkim_signing(
+            os.path.join(self.tmpdir, "opendkim.conf"), self.tmpdir
+        )
+        status.blocked.assert_called_with(
+            "No free milter instance port left for milter:197, ports 9000-9099 are all in use"
+        )
+        set_flag.assert_not_called()
+
+    @mock.patch("charms.reactive.clear_flag")
+    @mock.patch("charms.reactive.set_flag")
+    def test_configure_smtp_dkim_signing_milter_isolation_domains_invalid(
+        self, set_flag, clear_flag
+    ):
+        opendkim_conf_path = os.path.join(self.tmpdir, "opendkim.conf")
+        self.mock_config.return_value["milter_isolation_domains"] = "newsletter-relay"
+        smtp_dkim_signing.configure_smtp_dkim_signing(opendkim_conf_path, self.tmpdir)
+        status.blocked.assert_called_with("Invalid milter_isolation_domains provided")
+        set_flag.assert_not_called()
+
+    @mock.patch("charms.reactive.clear_flag")
+    @mock.patch("charms.reactive.set_flag")
+    @mock.patch("charmhelpers.core.host.service_pause")
+    @mock.patch("charmhelpers.core.host.service_resume")
+    @mock.patch("reactive.smtp_dkim_signing._drain_workers")
+    @mock.patch("subprocess.call")
+    def test_configure_smtp_dkim_signing_milter_proxy(
+        self, call, drain_workers, service_resume, service_pause, set_flag, clear_flag
+    ):  # pylint: disable=too-many-arguments,too-many-positional-arguments,too-many-locals
+        opendkim_conf_path = os.path.join(self.tmpdir, "opendkim.conf")
+        instances_dir = os.path.join(self.tmpdir, "opendkim.d")
+        proxy_conf_path = os.path.join(self.tmpdir, "opendkim-milter-proxy.json")
+        dropin_path = os.path.join(self.tmpdir, "system", "opendkim.service.d", "juju.conf")
+        unit_path = os.path.join(self.tmpdir, "system", "opendkim-milter-proxy.service")
+        proxy_path = os.path.join(self.tmpdir, "opendkim-milter-proxy")
+        patcher = mock.patch.object(smtp_dkim_signing, "MILTER_PROXY_PATH", proxy_path)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.mock_config.return_value.update(
+            {"milter_proxy_workers": 2, "service_memory_max": "512M"}
+        )
+        smtp_dkim_signing.configure_smtp_dkim_signing(opendkim_conf_path, self.tmpdir, dropin_path)
+
+        with open(os.path.join(instances_dir, "worker-2.conf"), "r", encoding="utf-8") as f:
+            got = f.read()
+        self.assertIn("Socket inet:8902@127.0.0.1\n", got)
+        self.assertIn("PidFile /run/opendkim/worker-2.pid\n", got)
+        with open(proxy_conf_path, "r", encoding="utf-8") as f:
+            self.assertEqual(
+                {
+                    "draining": [],
+                    "port": 8892,
+                    "stats": smtp_dkim_signing.MILTER_PROXY_STATS_PATH,
+                    "workers": [
+                        {"name": "worker-1", "port": 8901},
+                        {"name": "worker-2", "port": 8902},
+                    ],
+                },
+                json.load(f),
+            )
+        with open(unit_path, "r", encoding="utf-8") as f:
+            self.assertIn(
+                f"ExecStart=/usr/bin/python3 {proxy_path} --config {proxy_conf_path}\n", f.read()
+            )
+        self.assertTrue(os.access(proxy_path, os.X_OK))
+        # The proxy takes the milter port over from the main opendkim service.
+        service_pause.assert_called_once_with("opendkim")
+        service_resume.assert_has_calls(
+            [
+                mock.call("opendkim@worker-1"),
+                mock.call("opendkim@worker-2"),
+                mock.call("opendkim-milter-proxy"),
+            ]
+        )
+        self.mock_open_port.assert_called_with(8892, "TCP")
+        # Resource limits changed, so workers are drained before their restart,
+        # half of them at a time and all before the same deadline.
+        workers = {"worker-1": 8901, "worker-2": 8902}
+        drain_workers.assert_has_calls(
+            [
+                mock.call(proxy_conf_path, workers, ["worker-1"], mock.ANY),
+                mock.call(proxy_conf_path, workers, ["worker-2"], mock.ANY),
+            ]
+        )
+        self.assertEqual(1, len({c.args[3] for c in drain_workers.call_args_list}))
+
+        # Workers no longer wanted are drained before they are removed.
+        drain_workers.reset_mock()
+        service_pause.reset_mock()
+        self.mock_config.return_value["milter_proxy_workers"] = 1
+        smtp_dkim_signing.configure_smtp_dkim_signing(opendkim_conf_path, self.tmpdir, dropin_path)
+        drain_workers.assert_called_once_with(proxy_conf_path, workers, ["worker-2"], mock.ANY)
+        service_pause.assert_called_with("opendkim@worker-2")
+        self.assertEqual(["worker-1.conf"], os.listdir(instances_dir))
+
+        # The main opendkim service gets the milter port back when disabled.
+        service_resume.reset_mock()
+        self.mock_config.return_value["milter_proxy_workers"] = 0
+        smtp_dkim_signing.configure_smtp_dkim_signing(opendkim_conf_path, self.tmpdir, dropin_path)
+        service_pause.assert_has_calls(
+            [mock.call("opendkim-milter-proxy"), mock.call("opendkim@worker-1")]
+        )
+        service_resume.assert_called_once_with("opendkim")
+        self.assertFalse(os.path.exists(unit_path))
+        self.assertFalse(os.path.exists(proxy_conf_path))
+        self.assertEqual([], os.listdir(instances_dir))
+
+        self.mock_config.return_value["milter_proxy_workers"] = 33
+        smtp_dkim_signing.configure_smtp_dkim_signing(opendkim_conf_path, self.tmpdir, dropin_path)
+        status.blocked.assert_called_with("Invalid milter_proxy_workers provided")
+
+    @mock.patch("charms.reactive.clear_flag")
+    @mock.patch("charms.reactive.set_flag")
+    @mock.patch("charmhelpers.core.host.service_pause")
+    @mock.patch("charmhelpers.core.host.service_resume")
+    @mock.patch("reactive.smtp_dkim_signing._drain_workers")
+    @mock.patch("subprocess.call")
+    def test_configure_smtp_dkim_signing_milter_proxy_session_held(
+        self, call, drain_workers, service_resume, service_pause, set_flag, clear_flag
+    ):  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        opendkim_conf_path = os.path.join(self.tmpdir, "opendkim.conf")
+        instances_dir = os.path.join(self.tmpdir, "opendkim.d")
+        proxy_conf_path = os.path.join(self.tmpdir, "opendkim-milter-proxy.json")
+        dropin_path = os.path.join(self.tmpdir, "system", "opendkim.service.d", "juju.conf")
+        patcher = mock.patch.object(
+            smtp_dkim_signing, "MILTER_PROXY_PATH", os.path.join(self.tmpdir, "proxy")
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.mock_config.return_value["milter_proxy_workers"] = 2
+        smtp_dkim_signing.configure_smtp_dkim_signing(opendkim_conf_path, self.tmpdir, dropin_path)
+
+        # A session is held open on a worker no longer wanted, so the worker
+        # stays in the proxy config, draining, and keeps running.
+        drain_workers.reset_mock()
+        drain_workers.return_value = False
+        self.mock_service_reload.reset_mock()
+        self.mock_config.return_value["milter_proxy_workers"] = 1
+        smtp_dkim_signing.configure_smtp_dkim_signing(opendkim_conf_path, self.tmpdir, dropin_path)
+        workers = {"worker-1": 8901, "worker-2": 8902}
+        drain_workers.assert_called_once_with(proxy_conf_path, workers, ["worker-2"], mock.ANY)
+        self.mock_service_reload.assert_any_call("opendkim-milter-proxy")
+        with open(proxy_conf_path, "r", encoding="utf-8") as f:
+            conf = json.load(f)
+        self.assertEqual(["worker-2"], conf["draining"])
+        self.assertEqual(["worker-1", "worker-2"], [w["name"] for w in conf["workers"]])
+        self.assertNotIn(mock.call("opendkim@worker-2"), service_pause.call_args_list)
+        self.assertEqual(["worker-1.conf", "worker-2.conf"], sorted(os.listdir(instances_dir)))
+
+        # The worker is removed once the session ended.
+        drain_workers.reset_mock()
+        drain_workers.return_value = True
+        smtp_dkim_signing.configure_smtp_dkim_signing(opendkim_conf_path, self.tmpdir, dropin_path)
+        drain_workers.assert_called_once_with(proxy_conf_path, workers, ["worker-2"], mock.ANY)
+        service_pause.assert_called_with("opendkim@worker-2")
+        self.assertEqual(["worker-1.conf"], os.listdir(instances_dir))
+        with open(proxy_conf_path, "r", encoding="utf-8") as f:
+            conf = json.load(f)
+        self.assertEqual([], conf["draining"])
+        self.assertEqual(["worker-1"], [w["name"] for w in conf["workers"]])
+
+    @mock.patch("time.sleep")
+    def test__drain_workers(self, sleep):
+        proxy_conf_path = os.path.join(self.tmpdir, "opendkim-milter-proxy.json")
+        stats_path = os.path.join(self.tmpdir, "stats.json")
+        patcher = mock.patch.object(smtp_dkim_signing, "MILTER_PROXY_STATS_PATH", stats_path)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        stats: typing.Dict[str, typing.Any] = {
+            "reloaded": 0,
+            "workers": {
+                "worker-1": {"draining": True, "outstanding": 0},
+                "worker-2": {"draining": True, "outstanding": 0},
+            },
+        }
+        workers = {"worker-1": 8901, "worker-2": 8902}
+        with open(stats_path, "w", encoding="utf-8") as f:
+            json.dump(stats, f)
+
+        def reload(service):
+            # The proxy reports once it loaded the new config.
+            stats["reloaded"] = smtp_dkim_signing.time.time() + 1
+            with open(stats_path, "w", encoding="utf-8") as f:
+                json.dump(stats, f)
+
+        self.mock_service_reload.side_effect = reload
+        deadline = smtp_dkim_signing.time.time() + 60
+        self.assertTrue(
+            smtp_dkim_signing._drain_workers(
+                proxy_conf_path, workers, ["worker-1", "worker-2"], deadline
+            )
+        )
+        self.mock_service_reload.assert_called_once_with("opendkim-milter-proxy")
+        with open(proxy_conf_path, "r", encoding="utf-8") as f:
+            self.assertEqual(["worker-1", "worker-2"], json.load(f)["draining"])
+        sleep.assert_not_called()
+
+        # Workers are waited for until all of them are drained, or the deadline passes.
+        stats["workers"]["worker-2"]["outstanding"] = 1
+        sleep.side_effect = lambda _: reload(None)
+        self.assertFalse(
+            smtp_dkim_signing._drain_workers(
+                proxy_conf_path,
+                workers,
+                ["worker-1", "worker-2"],
+                smtp_dkim_signing.time.time() + 0.2,
+            )
+        )
+        sleep.assert_called()
+
+        # Stale statistics, from before the proxy reloaded, are not trusted.
+        sleep.reset_mock()
+        sleep.side_effect = None
+        self.mock_service_reload.side_effect = None
+        stats["reloaded"] = 0
+        stats["workers"]["worker-2"]["outstanding"] = 0
+        with open(stats_path, "w", encoding="utf-8") as f:
+            json.dump(stats, f)
+        smtp_dkim_signing._drain_workers(
+            proxy_conf_path, workers, ["worker-1"], smtp_dkim_signing.time.time() + 0.01
+        )
+        sleep.assert_called()
+
+    @mock.patch("charms.reactive.clear_flag")
+    def test_hook_milter_relation_instances(self, clear_flag):
+        smtp_dkim_signing.milter_relation_instances()
+        clear_flag.assert_not_called()
+
+        self.mock_config.return_value["milter_isolation"] = True
+        smtp_dkim_signing.milter_relation_instances()
+        clear_flag.assert_called_once_with("smtp-dkim-signing.configured")
+
+    @mock.patch("charms.reactive.clear_flag")
+    @mock.patch("charms.reactive.set_flag")
+    @mock.patch("milter_client.send_message")
+    @mock.patch("subprocess.run")
+    def test_configure_smtp_dkim_signing_rollout_canary(
+        self, run, send_message, set_flag, clear_flag
+    ):
+        opendkim_conf_path = os.path.join(self.tmpdir, "opendkim.conf")
+        self.mock_config.return_value.update(
+            {"rollout_canary": True, "trusted_sources": "10.0.0.0/8,mail.local"}
+        )
+        send_message.return_value = milter_client.MilterResult(
+            "continue", [("DKIM-Signature", "v=1; a=rsa-sha256; d=myawsomedomain.local")], 0.01
+        )
+        smtp_dkim_signing.configure_smtp_dkim_signing(opendkim_conf_path, self.tmpdir)
+
+        run.assert_called_once()
+        self.assertEqual(
+            ["opendkim", "-x", f"{opendkim_conf_path}.candidate"], run.call_args[0][0]
+        )
+        self.assertEqual(("127.0.0.1", 8893), send_message.call_args[0][0])
+        self.assertIn(b"From: canary@myawsomedomain.local\r\n", send_message.call_args[0][1])
+        self.assertEqual("10.0.0.0", send_message.call_args.kwargs["client_address"])
+        self.assertEqual("localhost", send_message.call_args.kwargs["client_hostname"])
+        self.assertFalse(os.path.exists(f"{opendkim_conf_path}.candidate"))
+        self.assertTrue(os.path.exists(opendkim_conf_path))
+        self.mock_service_reload.assert_called_once_with("opendkim")
+        set_flag.assert_called_once_with("smtp-dkim-signing.configured")
+
+        # Already validated and rolled out.
+        run.reset_mock()
+        self.mock_service_reload.reset_mock()
+        smtp_dkim_signing.configure_smtp_dkim_signing(opendkim_conf_path, self.tmpdir)
+        run.assert_not_called()
+        self.mock_service_reload.assert_not_called()
+
+    @mock.patch("charms.reactive.clear_flag")
+    @mock.patch("charms.reactive.set_flag")
+    @mock.patch("milter_client.send_message")
+    @mock.patch("subprocess.run")
+    def test_configure_smtp_dkim_signing_rollout_canary_failed(
+        self, run, send_message, set_flag, clear_flag
+    ):
+        opendkim_conf_path = os.path.join(self.tmpdir, "opendkim.conf")
+        with open(opendkim_conf_path, "w", encoding="utf-8") as f:
+            f.write("# Current config\n")
+        self.mock_config.return_value["rollout_canary"] = True
+        send_message.return_value = milter_client.MilterResult("tempfail", [], 0.01)
+        smtp_dkim_signing.configure_smtp_dkim_signing(opendkim_conf_path, self.tmpdir)
+
+        status.blocked.assert_called_once_with(
+            "Canary check failed, keeping current config: canary message got tempfail"
+        )
+        with open(opendkim_conf_path, "r", encoding="utf-8") as f:
+            self.assertEqual("# Current config\n", f.read())
+        self.mock_service_reload.assert_not_called()
+        set_flag.assert_not_called()
+
+        # The same candidate is not tried again.
+        run.reset_mock()
+        status.blocked.reset_mock()
+        smtp_dkim_signing.configure_smtp_dkim_signing(opendkim_conf_path, self.tmpdir)
+        run.assert_not_called()
+        status.blocked.assert_called_once_with(
+            "Canary check failed, keeping current config: canary message got tempfail"
+        )
+
+        # Unsigned.
+        send_message.return_value = milter_client.MilterResult("continue", [], 0.01)
+        self.mock_config.return_value["selector"] = "20250101"
+        smtp_dkim_signing.configure_smtp_dkim_signing(opendkim_conf_path, self.tmpdir)
+        status.blocked.assert_called_with(
+            "Canary check failed, keeping current config: canary message was not signed"
+        )
+
+        # Candidate does not start.
+        run.side_effect = subprocess.CalledProcessError(
+            78,
+            "opendkim",
+            stderr="opendkim: /etc/dkimkeys/20250102.private: key data is not secure\n",
+        )
+        self.mock_config.return_value["selector"] = "20250102"
+        smtp_dkim_signing.configure_smtp_dkim_signing(opendkim_conf_path, self.tmpdir)
+        status.blocked.assert_called_with(
+            "Canary check failed, keeping current config: "
+            "opendkim: /etc/dkimkeys/20250102.private: key data is not secure"
+        )
+        self.assertFalse(os.path.exists(f"{opendkim_conf_path}.candidate"))
+        set_flag.assert_not_called()
+
+    @mock.patch("charms.reactive.clear_flag")
+    @mock.patch("charms.reactive.set_flag")
+    @mock.patch("milter_client.send_message")
+    @mock.patch("subprocess.run")
+    def test_configure_smtp_dkim_signing_rollout_canary_staged(
+        self, run, send_message, set_flag, clear_flag
+    ):
+        opendkim_conf_path = os.path.join(self.tmpdir, "opendkim.conf")
+        keytable_path = os.path.join(self.tmpdir, "keytable")
+        with open("tests/unit/files/rotation_key.private", "r", encoding="utf-8") as f:
+            signing_key = f.read()
+        self.mock_config.return_value.update(
+            {
+                "keytable": "mail._domainkey.tenant.local tenant.local:mail:/srv/t.private",
+                "rollout_canary": True,
+                "signing_key": signing_key,
+            }
+        )
+        send_message.return_value = milter_client.MilterResult(
+            "continue", [("DKIM-Signature", "v=1; a=rsa-sha256; d=myawsomedomain.local")], 0.01
+        )
+        smtp_dkim_signing.configure_smtp_dkim_signing(opendkim_conf_path, self.tmpdir)
+        with open(keytable_path, "r", encoding="utf-8") as f:
+            keytable = f.read()
+
+        # The candidate loads the staged keys and tables, not the live ones.
+        staging_dir = os.path.join(self.tmpdir, smtp_dkim_signing.CANARY_STAGING_DIR)
+        with open("tests/unit/files/signing_key.private", "r", encoding="utf-8") as f:
+            self.mock_config.return_value["signing_key"] = f.read()
+        self.mock_config.return_value["keytable"] += "\nmail._domainkey.other.local x:y:/z"
+        self.mock_config.return_value["selector"] = "20250101"
+        send_message.return_value = milter_client.MilterResult("tempfail", [], 0.01)
+
+        def candidate(*args, **kwargs):
+            with open(f"{opendkim_conf_path}.candidate", "r", encoding="utf-8") as f:
+                conf = f.read()
+            self.assertIn(f"KeyFile {staging_dir}/20250101.private\n", conf)
+            self.assertIn(f"KeyTable file:{staging_dir}/keytable.candidate\n", conf)
+
+        run.side_effect = candidate
+        smtp_dkim_signing.configure_smtp_dkim_signing(opendkim_conf_path, self.tmpdir)
+        status.blocked.assert_called_with(
+            "Canary check failed, keeping current config: canary message got tempfail"
+        )
+
+        # A failed candidate leaves the live keys and tables as they were.
+        with open(keytable_path, "r", encoding="utf-8") as f:
+            self.assertEqual(keytable, f.read())
+        with open(os.path.join(self.tmpdir, "20210622.private"), "r", encoding="utf-8") as f:
+            self.assertEqual(signing_key, f.read())
+        self.assertFalse(os.path.exists(os.path.join(self.tmpdir, "20250101.private")))
+
+    def test__candidate_keytable(self):
+        keytable_path = os.path.join(self.tmpdir, "keytable")
+        with open(keytable_path, "w", encoding="utf-8") as f:
+            f.write(
+                "# Tenants\n"
+                "mail._domainkey.a.local a.local:mail:/etc/dkimkeys/a.private\n"
+                "mail._domainkey.b.local b.local:mail:/etc/dkimkeys/b.private\n"
+                "mail._domainkey.c.local c.local:mail:/srv/keys/a.private\n"
+            )
+        shutil.copy(
+            "tests/unit/files/rotation_key.private", os.path.join(self.tmpdir, "a.private")
+        )
+
+        got = smtp_dkim_signing._candidate_keytable(keytable_path, self.tmpdir)
+        with open(got, "r", encoding="utf-8") as f:
+            self.assertEqual(
+                "# Tenants\n"
+                f"mail._domainkey.a.local a.local:mail:{self.tmpdir}/a.private\n"
+                "mail._domainkey.b.local b.local:mail:/etc/dkimkeys/b.private\n"
+                "mail._domainkey.c.local c.local:mail:/srv/keys/a.private\n",
+                f.read(),
+            )
+
+    def test__canary_sender(self):
+        context = {"domains": "myawsomedomain.local", "signingtable": ""}
+        self.assertEqual("canary@myawsomedomain.local", smtp_dkim_signing._canary_sender(context))
+        context["domains"] = "*"
+        self.assertEqual("canary@example.com", smtp_dkim_signing._canary_sender(context))
+
+        # Domains attached as a resource are read from the file opendkim is given.
+        domains_path = os.path.join(self.tmpdir, "domains")
+        with open(domains_path, "w", encoding="utf-8") as f:
+            f.write("# Tenants\n*.wild.local\ntenant0.local\ntenant1.local\n")
+        context["domains"] = domains_path
+        self.assertEqual("canary@tenant0.local", smtp_dkim_signing._canary_sender(context))
+
+        # The signingtable picks the key when there is one.
+        context["signingtable"] = "tests/unit/files/signingtable"
+        self.assertEqual("canary@mydomain.local", smtp_dkim_signing._canary_sender(context))
+
+    def test__canary_client(self):
+        self.assertEqual(
+            ("localhost", "10.0.0.0"), smtp_dkim_signing._canary_client("mail.local,10.0.0.0/8")
+        )
+        self.assertEqual(
+            ("localhost", "2001:db8::"),
+            smtp_dkim_signing._canary_client("!192.0.2.1 2001:db8::/32"),
+        )
+        # Host names are matched against the client host name instead.
+        self.assertEqual(
+            ("mail.local", "127.0.0.1"), smtp_dkim_signing._canary_client("mail.local")
+        )
+        self.assertEqual(
+            ("canary.example.com", "127.0.0.1"), smtp_dkim_signing._canary_client(".example.com")
+        )
+
+    @mock.patch("reactive.smtp_dkim_signing._generate_signing_key")
+    def test_dkim_dns_records_auto(self, generate_signing_key):
+        with open("tests/unit/files/rotation_key.private", "r", encoding="utf-8") as f:
+            generate_signing_key.return_value = f.read()
+        self.mock_config.return_value["domains"] = "mydomain1.local,mydomain2.local"
+        self.mock_config.return_value["signing_key"] = "auto"
+        self._patch_secrets()
+        auto_keys = smtp_dkim_signing._auto_signing_keys(
+            self.mock_config.return_value, self.tmpdir
+        )
+        assert auto_keys is not None
+        for domain, signing_key in auto_keys.items():
+            smtp_dkim_signing._write_key(
+                signing_key, smtp_dkim_signing._auto_keyfile(self.tmpdir, "20210622", domain)
+            )
+
+        got = smtp_dkim_signing.dkim_dns_records(self.tmpdir)
+        self.assertEqual(["active"], list(got))
+        self.assertEqual(2, len(got["active"]))
+        self.assertTrue(got["active"][0].startswith("20210622._domainkey.mydomain1.local. "))
+        self.assertTrue(got["active"][1].startswith("20210622._domainkey.mydomain2.local. "))
+
+    @mock.patch("reactive.smtp_dkim_signing._sign_speed")
+    def test_audit_signing_keys(self, sign_speed):
+        sign_speed.side_effect = lambda algorithm, bits, seconds: {1024: 9000.0, 2048: 2000.0}[
+            bits
+        ]
+        shutil.copy(
+            "tests/unit/files/rotation_key.private", os.path.join(self.tmpdir, "20210622.private")
+        )
+        small_key = os.path.join(self.tmpdir, "small.private")
+        subprocess.check_call(  # nosec
+            ["openssl", "genrsa", "-out", small_key, "1024"], stderr=subprocess.DEVNULL
+        )
+        bad_key = os.path.join(self.tmpdir, "bad.private")
+        shutil.copy("tests/unit/files/signing_key.private", bad_key)
+        ec_key = os.path.join(self.tmpdir, "ec.private")
+        subprocess.check_call(  # nosec
+            ["openssl", "ecparam", "-name", "prime256v1", "-genkey", "-noout", "-out", ec_key],
+            stderr=subprocess.DEVNULL,
+        )
+        with open(os.path.join(self.tmpdir, "keytable"), "w", encoding="utf-8") as f:
+            f.write(
+                "# Tenants\n"
+                f"mail._domainkey.tenant1.local tenant1.local:mail:{small_key}\n"
+                f"mail._domainkey.tenant2.local tenant2.local:mail:{small_key}\n"
+                f"mail._domainkey.tenant3.local tenant3.local:mail:{bad_key}\n"
+                "mail._domainkey.tenant4.local tenant4.local:mail:/nonexistent.private\n"
+                "mail._domainkey.tenant5.local tenant5.local\n"
+                f"mail._domainkey.tenant6.local\ttenant6.local:mail:{small_key}\n"
+                f"mail._domainkey.tenant7.local tenant7.local:mail:{ec_key}\n"
+            )
+
+        got = smtp_dkim_signing.audit_signing_keys(self.tmpdir)
+        self.assertEqual(
+            [
+                os.path.join(self.tmpdir, "keytable"),
+                bad_key,
+                ec_key,
+                os.path.join(self.tmpdir, "20210622.private"),
+                small_key,
+            ],
+            [k["path"] for k in got],
+        )
+        # Malformed lines are skipped and reported, not raised.
+        self.assertEqual("malformed keytable line 6", got[0]["error"])
+        self.assertEqual("unable to parse private key", got[1]["error"])
+        # EC keys have the same header as RSA keys, but DKIM cannot sign with them.
+        self.assertEqual(
+            "unsupported key type, DKIM signs with RSA or Ed25519 keys", got[2]["error"]
+        )
+        self.assertEqual("rsa", got[3]["algorithm"])
+        self.assertEqual(2048, got[3]["bits"])
+        self.assertEqual(["myawsomedomain.local"], got[3]["tenants"])
+        self.assertEqual(2000.0, got[3]["signs_per_sec"])
+        self.assertTrue(got[3]["fingerprint"].startswith("SHA256:"))
+        self.assertEqual(1024, got[4]["bits"])
+        self.assertEqual(["tenant1.local", "tenant2.local", "tenant6.local"], got[4]["tenants"])
+        # Each key type is only benchmarked once.
+        self.assertEqual(2, len(sign_speed.mock_calls))
+
+    @mock.patch("subprocess.check_output")
+    def test__sign_speed(self, check_output):
+        check_output.return_value = "+DTP:2048:private:rsa:1\n+R1:2384:2048:1.00\n" + (
+            "+F2:2:2048:2384.848485:45474.000000\n"
+        )
+        self.assertEqual(2384.8, smtp_dkim_signing._sign_speed("rsa", 2048, 1))
+        check_output.assert_called_with(
+            ["openssl", "speed", "-mr", "-seconds", "1", "rsa2048"],
+            stderr=subprocess.DEVNULL,
+            text=True,
+        )
+
+        # Sizes openssl does not benchmark are estimated from the nearest one.
+        self.assertEqual(
+            round(2384.848485 * (2048 / 2200) ** 3, 1),
+            smtp_dkim_signing._sign_speed("rsa", 2200, 1),
+        )
+
+        check_output.return_value = "+F6:0:253:Ed25519:28315.306122:8926.262626\n"
+        self.assertEqual(28315.3, smtp_dkim_signing._sign_speed("ed25519", 256, 2))
+        check_output.assert_called_with(
+            ["openssl", "speed", "-mr", "-seconds", "2", "ed25519"],
+            stderr=subprocess.DEVNULL,
+            text=True,
+        )
+
+        # Records laid out differently than expected are not guessed at.
+        check_output.return_value = "+F2:2:2048:2384.848485:45474.000000:1.0\n"
+        self.assertRaises(ValueError, smtp_dkim_signing._sign_speed, "rsa", 2048, 1)
+
     @mock.patch("charms.reactive.clear_flag")
     @mock.patch("charms.reactive.set_flag")
     def test_hook_relation_milter_flags(self, set_flag, clear_flag):
@@ -417,12 +1829,154 @@ class TestCharm(unittest.TestCase):
     @mock.patch("charms.reactive.set_flag")
     @mock.patch("charmhelpers.core.hookenv.relation_ids")
     @mock.patch("charmhelpers.core.hookenv.relation_set")
-    def test_milter_notify(self, relation_set, relation_ids, set_flag, clear_flag):
-        relation_ids.return_value = ["milter:32"]
+    @mock.patch("os.cpu_count")
+    def test_milter_notify(self, cpu_count, relation_set, relation_ids, set_flag, clear_flag):
+        relation_ids.side_effect = lambda endpoint: {"milter": ["milter:32"]}.get(endpoint, [])
+        cpu_count.return_value = 4
         smtp_dkim_signing.milter_notify()
-        want = {"port": smtp_dkim_signing.OPENDKIM_MILTER_PORT}
+        pool = [
+            {
+                "address": "10.0.0.10",
+                "port": smtp_dkim_signing.OPENDKIM_MILTER_PORT,
+                "unit": "smtp-dkim-signing/0",
+                "weight": 4,
+            }
+        ]
+        want = {
+            "address": "10.0.0.10",
+            "command_timeout": 30,
+            "connect_timeout": 30,
+            "content_timeout": 300,
+            "default_action": "tempfail",
+            "port": smtp_dkim_signing.OPENDKIM_MILTER_PORT,
+            "units": json.dumps(pool, sort_keys=True),
+            "weight": 4,
+        }
         relation_set.assert_called_with(relation_id="milter:32", relation_settings=want)
 
+    @mock.patch("charms.reactive.clear_flag")
+    @mock.patch("charms.reactive.set_flag")
+    @mock.patch("charmhelpers.core.hookenv.relation_ids")
+    @mock.patch("charmhelpers.core.hookenv.relation_set")
+    def test_milter_notify_isolation(self, relation_set, relation_ids, set_flag, clear_flag):
+        relation_ids.side_effect = lambda endpoint: {"milter": ["milter:3", "milter:7"]}.get(
+            endpoint, []
+        )
+        self.mock_config.return_value["milter_isolation"] = True
+        self.mock_leader_get.return_value = {
+            smtp_dkim_signing.INSTANCE_PORTS_KEY: json.dumps({"milter:3": 9000, "milter:7": 9001})
+        }
+        smtp_dkim_signing.milter_notify()
+        for rid, port in (("milter:3", 9000), ("milter:7", 9001)):
+            got = [
+                c.kwargs["relation_settings"]
+                for c in relation_set.mock_calls
+                if c.kwargs["relation_id"] == rid
+            ][0]
+            self.assertEqual(port, got["port"])
+            self.assertEqual([port], [m["port"] for m in json.loads(got["units"])])
+
+    @mock.patch("charms.reactive.clear_flag")
+    @mock.patch("charms.reactive.set_flag")
+    @mock.patch("charmhelpers.core.hookenv.relation_ids")
+    @mock.patch("charmhelpers.core.hookenv.relation_set")
+    def test_milter_notify_timeouts(self, relation_set, relation_ids, set_flag, clear_flag):
+        relation_ids.side_effect = lambda endpoint: {"milter": ["milter:32"]}.get(endpoint, [])
+        self.mock_config.return_value.update(
+            {
+                "milter_command_timeout": 10,
+                "milter_connect_timeout": 5,
+                "milter_content_timeout": 60,
+                "milter_default_action": "accept",
+            }
+        )
+        smtp_dkim_signing.milter_notify()
+        got = relation_set.call_args.kwargs["relation_settings"]
+        self.assertEqual(10, got["command_timeout"])
+        self.assertEqual(5, got["connect_timeout"])
+        self.assertEqual(60, got["content_timeout"])
+        self.assertEqual("accept", got["default_action"])
+
+    @mock.patch("charms.reactive.clear_flag")
+    @mock.patch("charms.reactive.set_flag")
+    def test_configure_smtp_dkim_signing_milter_timeouts_invalid(self, set_flag, clear_flag):
+        opendkim_conf_path = os.path.join(self.tmpdir, "opendkim.conf")
+
+        self.mock_config.return_value["milter_command_timeout"] = 0
+        self.mock_config.return_value["milter_content_timeout"] = -5
+        smtp_dkim_signing.configure_smtp_dkim_signing(opendkim_conf_path, self.tmpdir)
+        status.blocked.assert_called_with(
+            "Invalid milter_command_timeout, milter_content_timeout provided"
+        )
+        set_flag.assert_not_called()
+
+    @mock.patch("charms.reactive.clear_flag")
+    @mock.patch("charms.reactive.set_flag")
+    @mock.patch("charmhelpers.core.hookenv.relation_ids")
+    @mock.patch("charmhelpers.core.hookenv.related_units")
+    @mock.patch("charmhelpers.core.hookenv.relation_get")
+    @mock.patch("charmhelpers.core.hookenv.relation_set")
+    def test_milter_notify_pool(
+        self, relation_set, relation_get, related_units, relation_ids, set_flag, clear_flag
+    ):  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        relation_ids.side_effect = lambda endpoint: {
+            "milter": ["milter:32"],
+            "peer": ["peer:1"],
+        }.get(endpoint, [])
+        related_units.return_value = ["smtp-dkim-signing/1", "smtp-dkim-signing/2"]
+        relation_get.side_effect = lambda rid, unit: {
+            "smtp-dkim-signing/1": {
+                "address": "10.0.0.11",
+                "port": "8892",
+                "state": "active",
+                "unit": "smtp-dkim-signing/1",
+                "weight": "8",
+            },
+            "smtp-dkim-signing/2": {"address": "10.0.0.12", "state": "maintenance"},
+        }[unit]
+        self.mock_config.return_value["milter_weight"] = 2
+        smtp_dkim_signing.milter_notify()
+
+        member = {
+            "address": "10.0.0.10",
+            "port": smtp_dkim_signing.OPENDKIM_MILTER_PORT,
+            "unit": "smtp-dkim-signing/0",
+            "weight": 2,
+        }
+        relation_set.assert_any_call(
+            relation_id="peer:1", relation_settings=dict(member, state="active")
+        )
+        # Units in maintenance are dropped from the pool.
+        pool = [
+            member,
+            {
+                "address": "10.0.0.11",
+                "port": 8892,
+                "unit": "smtp-dkim-signing/1",
+                "weight": 8,
+            },
+        ]
+        want = {
+            "address": "10.0.0.10",
+            "command_timeout": 30,
+            "connect_timeout": 30,
+            "content_timeout": 300,
+            "default_action": "tempfail",
+            "port": smtp_dkim_signing.OPENDKIM_MILTER_PORT,
+            "units": json.dumps(pool, sort_keys=True),
+            "weight": 2,
+        }
+        relation_set.assert_called_with(relation_id="milter:32", relation_settings=want)
+
+    @mock.patch("charmhelpers.core.hookenv.relation_ids")
+    @mock.patch("charmhelpers.core.hookenv.relation_set")
+    def test_leave_pool(self, relation_set, relation_ids):
+        relation_ids.side_effect = lambda endpoint: {"peer": ["peer:1"]}.get(endpoint, [])
+        smtp_dkim_signing.leave_pool()
+        relation_set.assert_called_once_with(
+            relation_id="peer:1", relation_settings={"state": "maintenance"}
+        )
+
     @mock.patch("charms.reactive.clear_flag")
     @mock.patch("charms.reactive.set_flag")
     @mock.patch("charmhelpers.core.hookenv.relation_ids")
@@ -462,6 +2016,25 @@ class TestCharm(unittest.TestCase):
         )
         status.active.assert_called_once_with("Ready (source version/commit 38c901f-dirty)")
 
+    def test_import_defers_jinja2(self):
+        # Hooks with nothing to render should not pay for importing jinja2.
+        snippet = (
+            "import sys, types;"
+            "sys.modules['charms.layer'] = types.ModuleType('charms.layer');"
+            "sys.modules['charms.layer'].status = None;"
+            f"sys.path.insert(0, {self.charm_dir!r});"
+            f"sys.path.insert(0, {os.path.join(self.charm_dir, 'lib')!r});"
+            "from reactive import smtp_dkim_signing;"
+            "print('jinja2' in sys.modules)"
+        )
+        output = subprocess.check_output([sys.executable, "-c", snippet], text=True)  # nosec
+        self.assertEqual("False", output.strip())
+
+    def test__render_template_cached(self):
+        want = smtp_dkim_signing._template_env()
+        self.assertIs(want, smtp_dkim_signing._template_env())
+        self.assertIsNotNone(want.bytecode_cache)
+
     def test__write_file(self):
         source = "# User-provided config added here"
         dest = os.path.join(self.tmpdir, "my-test-file")